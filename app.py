@@ -1,19 +1,40 @@
-from flask import Flask, render_template, request, redirect, jsonify, flash, session, url_for
+from flask import (Flask, render_template, request, redirect, jsonify, flash, session, url_for, g, has_request_context,
+                   Response, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text
+from sqlalchemy import text, insert, update, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.pool import Pool, QueuePool, NullPool
+from sqlalchemy.exc import IntegrityError
 import os
 from dotenv import load_dotenv
 import json
+import csv
+import io
+from decimal import Decimal
 from werkzeug.utils import secure_filename
 import cloudinary
 import cloudinary.uploader
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import queue
+from collections import OrderedDict, namedtuple, deque
+import threading
+import time
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import secrets
-from datetime import datetime, timedelta
+import hashlib
+from datetime import datetime, timedelta, timezone
 import stripe
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+from credentials import PasswordHasher, DEFAULT_METHOD as DEFAULT_PASSWORD_HASH_METHOD
+from grading import (build_answer_key, collect_answers, score_answers, grade_batch, ItemStatistics,
+                     percentage as grade_percentage)
 
 load_dotenv()
 cloudinary.config(
@@ -39,8 +60,103 @@ if not db_url:
 elif db_url.startswith("postgres://"):
     db_url = db_url.replace("postgres://", "postgresql://", 1)
 
+# queue for long-lived workers (gunicorn), null for serverless (Vercel); override with DB_POOL_MODE
+db_pool_mode = os.getenv('DB_POOL_MODE', 'null' if is_vercel else 'queue').lower()
+
+pool_metrics = {
+    'checkouts': 0,
+    'connects': 0,
+    'invalidations': 0,
+    'checkout_wait_ms': 0.0,
+    'max_checkout_wait_ms': 0.0,
+}
+pool_metrics_lock = threading.Lock()
+
+
+def record_pool_metric(name, value=1):
+    with pool_metrics_lock:
+        pool_metrics[name] += value
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long requests wait for a free connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = (time.perf_counter() - start) * 1000
+            with pool_metrics_lock:
+                pool_metrics['checkout_wait_ms'] += waited
+                pool_metrics['max_checkout_wait_ms'] = max(pool_metrics['max_checkout_wait_ms'], waited)
+
+
+def is_pooled_endpoint(url):
+    # Neon's PgBouncer endpoints carry -pooler in the host; PGBOUNCER=1 covers self-hosted setups
+    return '-pooler.' in url or os.getenv('PGBOUNCER') == '1'
+
+
+def engine_options(url):
+    """Pick the pooling strategy for this deployment: NullPool on serverless, a pre-pinged QueuePool elsewhere"""
+    if url.startswith('sqlite'):
+        return {}
+
+    options = {'connect_args': {'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 10))}}
+    if db_pool_mode == 'null':
+        # A frozen serverless instance can't keep sockets alive, so every request gets a fresh
+        # connection and the pooling is left to the pooled endpoint in front of Postgres
+        options['poolclass'] = NullPool
+        if not is_pooled_endpoint(url):
+            print("Warning: serverless deployment without a pooled database endpoint; use Neon's -pooler host.")
+    else:
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=int(os.getenv('DB_POOL_SIZE', 5)),
+            max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 10)),
+            pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', 30)),
+            # Recycle before Neon or a proxy idles the connection out, and ping so stale ones never reach a request
+            pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 300)),
+            pool_pre_ping=True,
+        )
+    return options
+
+
 app.config['SQLALCHEMY_DATABASE_URI'] = db_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(db_url)
+
+
+@event.listens_for(Pool, 'checkout')
+def count_pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    record_pool_metric('checkouts')
+
+
+@event.listens_for(Pool, 'connect')
+def count_pool_connect(dbapi_connection, connection_record):
+    record_pool_metric('connects')
+
+
+@event.listens_for(Pool, 'invalidate')
+def count_pool_invalidation(dbapi_connection, connection_record, exception):
+    record_pool_metric('invalidations')
+
+
+def pool_status():
+    pool = db.engine.pool
+    with pool_metrics_lock:
+        status = dict(pool_metrics)
+    status['mode'] = db_pool_mode if not db_url.startswith('sqlite') else 'sqlite'
+    status['pooled_endpoint'] = is_pooled_endpoint(db_url)
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            idle=pool.checkedin()
+        )
+    return status
+
 
 @app.route('/health')
 def health_check():
@@ -61,7 +177,8 @@ def health_check():
             # "razorpay_configured": bool(os.getenv('RAZORPAY_KEY_ID')),
             "smtp_configured": bool(os.getenv('SMTP_SERVER'))
         },
-        "db_connection": db_status
+        "db_connection": db_status,
+        "db_pool": pool_status()
     })
 
 @app.errorhandler(500)
@@ -73,6 +190,7 @@ def internal_error(error):
 
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 stripe_publishable_key = os.getenv('STRIPE_PUBLISHABLE_KEY')
+stripe_webhook_secret = os.getenv('STRIPE_WEBHOOK_SECRET')
 
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
 ALLOWED_EXTENSIONS = {'pdf', 'mp4', 'avi', 'mov', 'mkv', 'txt', 'doc', 'docx', 'ppt', 'pptx', 'zip', 'rar', 'jpg', 'jpeg', 'png', 'gif', 'mp3', 'wav'}
@@ -83,6 +201,12 @@ except Exception as e:
     print(f"Warning: Could not create upload folder: {e}. This is expected on Vercel.")
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Callable with cloudinary.uploader.upload's signature; set it to a local fake in tests and dev
+app.config['MATERIAL_UPLOADER'] = None
+
+# Bounded pool so one teacher's batch of videos can't open unlimited connections to Cloudinary
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 4))
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='material-upload')
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -111,10 +235,10 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
     email = db.Column(db.String(100), unique=True)
-    password = db.Column(db.String(100))
+    password = db.Column(db.String(255))  # credentials.PasswordHasher hash; legacy rows may still be plaintext
     role = db.Column(db.String(20))
     email_verified = db.Column(db.Boolean, default=False)
-    verification_token = db.Column(db.String(100), nullable=True)
+    verification_token = db.Column(db.String(100), nullable=True, index=True)
     token_expiry = db.Column(db.DateTime, nullable=True)
 
 
@@ -124,22 +248,49 @@ class Course(db.Model):
     title = db.Column(db.String(100))
     description = db.Column(db.Text)
     content = db.Column(db.Text)
-    materials = db.Column(db.Text, default='')  # JSON string of uploaded files
-    teacher_id = db.Column(db.Integer)
+    materials = db.Column(db.Text, default='')  # Legacy JSON blob, moved into course_materials by migrate_enhanced.py
+    teacher_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     price = db.Column(db.Numeric(10, 2), default=0.00)  # Course price
     currency = db.Column(db.String(3), default='INR')  # Currency code
 
 
+class CourseMaterial(db.Model):
+    __tablename__ = 'course_materials'
+    __table_args__ = (
+        db.Index('uq_course_materials_course_position', 'course_id', 'position', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)  # Display order within the course
+    name = db.Column(db.String(255))
+    path = db.Column(db.Text)  # Cloudinary URL or YouTube link
+    type = db.Column(db.String(20))  # file, youtube
+    cloudinary_id = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class Enrollment(db.Model):
     __tablename__ = 'enrollments'
+    __table_args__ = (
+        # Also serves every lookup by student_id on its own
+        db.Index('uq_enrollments_student_course', 'student_id', 'course_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    student_id = db.Column(db.Integer)
-    course_id = db.Column(db.Integer)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), index=True)
     enrolled_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+PENDING_PAYMENT_WHERE = db.text("status = 'pending'")
+
+
 class Payment(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = (
+        # At most one open checkout per student and course; double-clicks reuse it instead of adding rows
+        db.Index('uq_payments_pending_student_course', 'student_id', 'course_id', unique=True,
+                 postgresql_where=PENDING_PAYMENT_WHERE, sqlite_where=PENDING_PAYMENT_WHERE),
+    )
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     course_id = db.Column(db.Integer, db.ForeignKey('courses.id'))
@@ -147,27 +298,57 @@ class Payment(db.Model):
     currency = db.Column(db.String(3), default='INR')
     payment_gateway = db.Column(db.String(20), default='razorpay')
     transaction_id = db.Column(db.String(100), unique=True, nullable=True)
-    order_id = db.Column(db.String(100))
-    status = db.Column(db.String(20), default='pending')  # pending, completed, failed, refunded
+    order_id = db.Column(db.String(100), index=True)
+    status = db.Column(db.String(20), default='pending')  # pending, completed, failed, expired, refunded
     payment_method = db.Column(db.String(50), nullable=True)
+    checkout_url = db.Column(db.Text, nullable=True)  # Hosted Stripe Checkout page, reused until it expires
+    expires_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class StripeEvent(db.Model):
+    __tablename__ = 'stripe_events'
+    __table_args__ = (
+        db.Index('ix_stripe_events_status_received', 'status', 'received_at'),
+    )
+    id = db.Column(db.String(255), primary_key=True)  # Stripe's event id, so redeliveries collide
+    type = db.Column(db.String(100))
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(20), default='pending')  # pending, processing, processed, failed
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+
+class RevenueRollup(db.Model):
+    __tablename__ = 'revenue_rollups'
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)  # UTC day the payment completed
+    currency = db.Column(db.String(3), primary_key=True)
+    payment_count = db.Column(db.Integer, default=0, nullable=False)  # Paid enrollments
+    revenue = db.Column(db.Numeric(14, 2), default=0, nullable=False)
+
+
 class Quiz(db.Model):
     __tablename__ = 'quizzes'
     id = db.Column(db.Integer, primary_key=True)
-    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'))
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), index=True)
     title = db.Column(db.String(200))
     description = db.Column(db.Text, nullable=True)
     duration_minutes = db.Column(db.Integer, nullable=True)  # Optional time limit
     passing_score = db.Column(db.Integer, default=60)  # Percentage
-    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, default=1, nullable=False)  # Bumped whenever questions change; keys caches
 
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        db.Index('ix_questions_quiz_order', 'quiz_id', 'order'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'))
     question_text = db.Column(db.Text)
@@ -180,6 +361,12 @@ class Question(db.Model):
 
 class QuizAttempt(db.Model):
     __tablename__ = 'quiz_attempts'
+    __table_args__ = (
+        # One row per quiz session: a double-submit of the same signed start time can't insert twice
+        db.Index('uq_quiz_attempts_student_quiz_started', 'student_id', 'quiz_id', 'started_at', unique=True),
+        # Newest-first pages per quiz for the tracker (read backwards); also serves plain quiz_id lookups
+        db.Index('ix_quiz_attempts_quiz_submitted', 'quiz_id', 'submitted_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'))
     student_id = db.Column(db.Integer, db.ForeignKey('users.id'))
@@ -192,12 +379,70 @@ class QuizAttempt(db.Model):
     submitted_at = db.Column(db.DateTime, nullable=True)
 
 
+class QuizSummary(db.Model):
+    __tablename__ = 'quiz_summaries'
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), primary_key=True)
+    attempt_count = db.Column(db.Integer, default=0, nullable=False)  # Submitted attempts only
+    passed_count = db.Column(db.Integer, default=0, nullable=False)
+    percentage_total = db.Column(db.Numeric(14, 2), default=0, nullable=False)  # Sum of attempt percentages, for the mean
+    last_submitted_at = db.Column(db.DateTime, nullable=True)
+
+
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(255))
+    to_email = db.Column(db.String(255))
+    subject = db.Column(db.String(255))
+    text_body = db.Column(db.Text)
+    html_body = db.Column(db.Text)
+    status = db.Column(db.String(20), default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)  # Also the lease expiry while sending
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+
+class UserPurge(db.Model):
+    """Queued background deletion of one account; while the row exists the user counts as pending deletion"""
+    __tablename__ = 'user_purges'
+    __table_args__ = (
+        db.Index('ix_user_purges_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    user_id = db.Column(db.Integer, primary_key=True)  # Removed in the same transaction as the user
+    status = db.Column(db.String(20), default='pending')  # pending, running, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)  # Also the lease expiry while running
+    last_error = db.Column(db.Text, nullable=True)
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def account_is_active(user_id):
+    """The user still exists and isn't queued for deletion; one primary-key lookup"""
+    row = (
+        db.session.query(User.id, UserPurge.user_id.label('purge_id'))
+        .outerjoin(UserPurge, UserPurge.user_id == User.id)
+        .filter(User.id == user_id)
+        .first()
+    )
+    return row is not None and row.purge_id is None
+
+
 def role_required(*allowed_roles):
     def decorator(f):
         @wraps(f)
         def wrapped(*args, **kwargs):
             if 'id' not in session:
                 return redirect(url_for('login_page'))
+            # Sessions live in the cookie, so an account queued for purge is shut out here rather than at logout
+            if not account_is_active(session['id']):
+                session.clear()
+                flash('Your account is no longer available.')
+                return redirect(url_for('login_page'))
             user_role = session.get('role')
         
             if user_role == 'admin':
@@ -213,123 +458,414 @@ def role_required(*allowed_roles):
         return wrapped
     return decorator
 
+
+# Vercel Cron calls these routes with "Authorization: Bearer $CRON_SECRET"; workers can do the same
+cron_secret = os.getenv('CRON_SECRET')
+
+
+def cron_required(f):
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        if not cron_secret:
+            return jsonify({'error': 'CRON_SECRET is not configured'}), 503
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not secrets.compare_digest(token, cron_secret):
+            return jsonify({'error': 'Forbidden'}), 403
+        return f(*args, **kwargs)
+    return wrapped
+
+
+# Per-process request profiling: statement counts and timings per request, kept per endpoint
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+REQUEST_METRICS_WINDOW = int(os.getenv('REQUEST_METRICS_WINDOW', 1000))  # Most recent requests kept per endpoint
+request_metrics = {}
+request_metrics_lock = threading.Lock()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = (time.perf_counter() - conn.info['query_started'].pop()) * 1000
+    endpoint = 'background'
+    if has_request_context():
+        endpoint = request.endpoint or request.path
+        if 'query_count' in g:
+            g.query_count += 1
+            g.query_ms += elapsed
+    if elapsed >= SLOW_QUERY_MS:
+        if has_request_context() and 'slow_queries' in g:
+            g.slow_queries += 1
+        app.logger.warning('Slow query (%.1f ms) in %s: %s', elapsed, endpoint, ' '.join(statement.split())[:500])
+
+
+@event.listens_for(Engine, 'handle_error')
+def drop_query_timer(context):
+    # A failed statement never reaches after_cursor_execute
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.query_count = 0
+    g.query_ms = 0.0
+    g.slow_queries = 0
+
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = (time.perf_counter() - g.request_started) * 1000
+    endpoint = request.endpoint or 'unmatched'
+    with request_metrics_lock:
+        metrics = request_metrics.get(endpoint)
+        if metrics is None:
+            metrics = request_metrics[endpoint] = {
+                'requests': 0,
+                'slow_queries': 0,
+                'latency_ms': deque(maxlen=REQUEST_METRICS_WINDOW),
+                'queries': deque(maxlen=REQUEST_METRICS_WINDOW),
+                'db_ms': deque(maxlen=REQUEST_METRICS_WINDOW),
+            }
+        metrics['requests'] += 1
+        metrics['slow_queries'] += g.slow_queries
+        metrics['latency_ms'].append(elapsed)
+        metrics['queries'].append(g.query_count)
+        metrics['db_ms'].append(g.query_ms)
+    return response
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = -(-pct * len(sorted_values) // 100)
+    return sorted_values[max(rank - 1, 0)]
+
+
+def request_metrics_summary():
+    with request_metrics_lock:
+        snapshot = {
+            endpoint: (metrics['requests'], metrics['slow_queries'],
+                       sorted(metrics['latency_ms']), sorted(metrics['queries']), sorted(metrics['db_ms']))
+            for endpoint, metrics in request_metrics.items()
+        }
+    summary = {}
+    for endpoint, (requests_seen, slow_queries, latency, queries, db_ms) in snapshot.items():
+        summary[endpoint] = {
+            'requests': requests_seen,
+            'sampled': len(latency),
+            'p50_ms': round(percentile(latency, 50), 2),
+            'p95_ms': round(percentile(latency, 95), 2),
+            'p99_ms': round(percentile(latency, 99), 2),
+            'queries_p50': percentile(queries, 50),
+            'queries_p95': percentile(queries, 95),
+            'queries_max': queries[-1],
+            'db_ms_p95': round(percentile(db_ms, 95), 2),
+            'slow_queries': slow_queries,
+        }
+    return summary
+
+
+@app.route('/admin/metrics', methods=['GET'])
+@role_required('admin')
+def admin_metrics():
+    """Latency and query-count percentiles per endpoint for this worker process; ?reset=1 clears them"""
+    summary = request_metrics_summary()
+    if request.args.get('reset') == '1':
+        with request_metrics_lock:
+            request_metrics.clear()
+    return jsonify({
+        'window': REQUEST_METRICS_WINDOW,
+        'slow_query_ms': SLOW_QUERY_MS,
+        'endpoints': summary,
+        'db_pool': pool_status()
+    })
+
+# Resolved once at startup instead of on every send
+SMTP_SETTINGS = {
+    'server': os.getenv('SMTP_SERVER'),
+    'port': int(os.getenv('SMTP_PORT', 587)),
+    'username': os.getenv('SMTP_USERNAME'),
+    'password': os.getenv('SMTP_PASSWORD'),
+    # Local stand-ins such as aiosmtpd speak plain SMTP without TLS or auth
+    'starttls': os.getenv('SMTP_STARTTLS', '1') == '1',
+    'from_email': os.getenv('SMTP_FROM_EMAIL'),
+    'from_name': os.getenv('SMTP_FROM_NAME'),
+}
+
+# Subjects are str.format patterns; bodies live in templates/emails/<name>.html and .txt
+EMAIL_TEMPLATES = {
+    'verification': {
+        'subject': 'Verify Your Email - Online Course Platform',
+        'from_name': 'Online Course Platform',
+    },
+    'course_assigned': {
+        'subject': 'New Course Assigned: {course_title}',
+        'from_name': 'EduStream Admin',
+    },
+    'announcement': {
+        'subject': '{subject}',
+        'from_name': 'EduStream Admin',
+    },
+}
+
+
+def compile_email_templates():
+    """Load and compile every email template once so sends only pay for rendering"""
+    compiled = {}
+    for name, spec in EMAIL_TEMPLATES.items():
+        from_name = SMTP_SETTINGS['from_name'] or spec['from_name']
+        compiled[name] = {
+            'subject': spec['subject'],
+            'sender': f"{from_name} <{SMTP_SETTINGS['from_email']}>",
+            'html': app.jinja_env.get_template(f'emails/{name}.html'),
+            'text': app.jinja_env.get_template(f'emails/{name}.txt'),
+        }
+    return compiled
+
+
+compiled_email_templates = compile_email_templates()
+
+
+def render_email(template_name, to_email, **context):
+    """Render one email into outbox fields using the precompiled templates"""
+    template = compiled_email_templates[template_name]
+    return {
+        'sender': template['sender'],
+        'to_email': to_email,
+        'subject': template['subject'].format(**context),
+        'text_body': template['text'].render(context),
+        'html_body': template['html'].render(context),
+    }
+
+
+def render_emails(template_name, recipients):
+    """Bulk render: recipients is an iterable of (to_email, context) pairs sharing one template"""
+    return [render_email(template_name, to_email, **context) for to_email, context in recipients]
+
+
 def send_verification_email(user_email, user_name, token):
-    """Send email verification link to user"""
+    """Queue the email verification link for delivery by the outbox worker"""
     try:
-        smtp_server = os.getenv('SMTP_SERVER')
-        smtp_port = int(os.getenv('SMTP_PORT', 587))
-        smtp_username = os.getenv('SMTP_USERNAME')
-        smtp_password = os.getenv('SMTP_PASSWORD')
-        from_email = os.getenv('SMTP_FROM_EMAIL')
-        from_name = os.getenv('SMTP_FROM_NAME', 'Online Course Platform')
-        
         verification_link = url_for('verify_email', token=token, _external=True)
-        
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = 'Verify Your Email - Online Course Platform'
-        msg['From'] = f'{from_name} <{from_email}>'
-        msg['To'] = user_email
-        
-    
-        html = f"""
-        <html>
-          <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 5px;">
-              <h2 style="color: #4CAF50;">Welcome to Online Course Platform!</h2>
-              <p>Hi {user_name},</p>
-              <p>Thank you for registering! Please verify your email address to complete your registration.</p>
-              <p style="margin: 30px 0;">
-                <a href="{verification_link}" 
-                   style="background-color: #4CAF50; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; display: inline-block;">
-                  Verify Email Address
-                </a>
-              </p>
-              <p>Or copy and paste this link into your browser:</p>
-              <p style="color: #666; font-size: 12px; word-break: break-all;">{verification_link}</p>
-              <p style="margin-top: 30px; color: #666; font-size: 12px;">
-                This link will expire in 24 hours. If you didn't create an account, please ignore this email.
-              </p>
-            </div>
-          </body>
-        </html>
-        """
-            
-        text = f"""
-        Welcome to Online Course Platform!
-        
-        Hi {user_name},
-        
-        Thank you for registering! Please verify your email address by clicking the link below:
-        
-        {verification_link}
-        
-        This link will expire in 24 hours. If you didn't create an account, please ignore this email.
-        """
-        
-        part1 = MIMEText(text, 'plain')
-        part2 = MIMEText(html, 'html')
-        msg.attach(part1)
-        msg.attach(part2)
-        
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            server.send_message(msg)
-        
+        queue_emails([render_email(
+            'verification', user_email,
+            user_name=user_name,
+            verification_link=verification_link
+        )])
         return True
     except Exception as e:
-        print(f"Error sending email: {e}")
+        print(f"Error queueing email: {e}")
         return False
 
 
 def send_assignment_email(teacher_email, teacher_name, course_title):
-    """Notify teacher that they have been assigned a course by Admin/HR"""
+    """Queue a notice that the teacher has been assigned a course by Admin/HR"""
     try:
-        smtp_server = os.getenv('SMTP_SERVER')
-        smtp_port = int(os.getenv('SMTP_PORT', 587))
-        smtp_username = os.getenv('SMTP_USERNAME')
-        smtp_password = os.getenv('SMTP_PASSWORD')
-        from_email = os.getenv('SMTP_FROM_EMAIL')
-        from_name = os.getenv('SMTP_FROM_NAME', 'EduStream Admin')
-        
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = f'New Course Assigned: {course_title}'
-        msg['From'] = f'{from_name} <{from_email}>'
-        msg['To'] = teacher_email
-        html = f"""
-        <html>
-          <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 5px;">
-              <h2 style="color: #6366f1;">New Course Assignment</h2>
-              <p>Hi {teacher_name},</p>
-              <p>You have been assigned a new course by the <strong>Admin/HR Department</strong>.</p>
-              <div style="background: #f8fafc; padding: 15px; border-left: 4px solid #6366f1; margin: 20px 0;">
-                <strong>Course Title:</strong> {course_title}
-              </div>
-              <p>You can now log in to your dashboard to add course materials, quizzes, and manage students.</p>
-              <p style="margin-top: 30px; color: #666; font-size: 12px;">
-                This is an automated notification from the EduStream Platform.
-              </p>
-            </div>
-          </body>
-        </html>
-        """
-        
-        part1 = MIMEText(f"Hi {teacher_name},\n\nYou have been assigned a new course: {course_title}. Please log in to your dashboard to manage it.", 'plain')
-        part2 = MIMEText(html, 'html')
-        msg.attach(part1)
-        msg.attach(part2)
-    
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            server.send_message(msg)
-        
+        queue_emails([render_email(
+            'course_assigned', teacher_email,
+            teacher_name=teacher_name,
+            course_title=course_title
+        )])
         return True
     except Exception as e:
-        print(f"Error sending assignment email: {e}")
+        print(f"Error queueing assignment email: {e}")
         return False
 
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))
+OUTBOX_BASE_BACKOFF_SECONDS = 30
+OUTBOX_MAX_BACKOFF_SECONDS = 3600
+# A worker that dies mid-batch leaves rows in 'sending'; they become due again after this lease
+OUTBOX_LEASE_SECONDS = 600
+
+# Drain the outbox on a background thread after queueing. Turn off when email_worker.py runs separately.
+# Serverless instances freeze once the response is sent, so on Vercel the thread is off and /cron/outbox
+# delivers instead. OUTBOX_INLINE_DELIVERY=1 opts in to sending just the queued messages inside the
+# request (never other queued mail), trading signup latency for immediacy.
+app.config['OUTBOX_BACKGROUND_DELIVERY'] = os.getenv('OUTBOX_BACKGROUND_DELIVERY', '0' if is_vercel else '1') == '1'
+app.config['OUTBOX_INLINE_DELIVERY'] = os.getenv('OUTBOX_INLINE_DELIVERY', '0') == '1'
+outbox_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='email-outbox')
+
+
+class SMTPConnectionPool:
+    """Keeps logged-in SMTP connections open between batches instead of reconnecting per email"""
+
+    def __init__(self, size=2):
+        self.size = size
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        server = smtplib.SMTP(SMTP_SETTINGS['server'], SMTP_SETTINGS['port'], timeout=30)
+        if SMTP_SETTINGS['starttls']:
+            server.starttls()
+        if SMTP_SETTINGS['username']:
+            server.login(SMTP_SETTINGS['username'], SMTP_SETTINGS['password'])
+        return server
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def acquire(self):
+        while True:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close(server)
+
+    def release(self, server):
+        if self._idle.qsize() < self.size:
+            self._idle.put(server)
+        else:
+            self._close(server)
+
+    @contextmanager
+    def connection(self):
+        server = self.acquire()
+        try:
+            yield server
+        except BaseException:
+            # The connection may be half-way through a command; never hand it out again
+            self._close(server)
+            raise
+        self.release(server)
+
+
+smtp_pool = SMTPConnectionPool()
+
+
+def queue_emails(messages):
+    """Persist rendered emails (see render_email) in the outbox with one bulk INSERT"""
+    email_ids = db.session.execute(insert(EmailOutbox).returning(EmailOutbox.id), messages).scalars().all()
+    db.session.commit()
+    schedule_outbox_delivery(email_ids)
+
+
+def schedule_outbox_delivery(email_ids=()):
+    """Hand freshly queued mail to the background thread, or send just `email_ids` inline when opted in"""
+    if app.config['OUTBOX_BACKGROUND_DELIVERY']:
+        outbox_executor.submit(deliver_outbox_in_background)
+    elif app.config['OUTBOX_INLINE_DELIVERY'] and email_ids:
+        try:
+            deliver_outbox(batch_size=len(email_ids), max_batches=1, email_ids=email_ids)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error delivering outbox: {e}")
+
+
+def deliver_outbox_in_background():
+    with app.app_context():
+        try:
+            deliver_outbox()
+        except Exception as e:
+            print(f"Error delivering outbox: {e}")
+
+
+def claim_outbox_batch(batch_size, email_ids=None):
+    now = datetime.utcnow()
+    query = EmailOutbox.query.filter(EmailOutbox.status.in_(('pending', 'sending')), EmailOutbox.next_attempt_at <= now)
+    if email_ids is not None:
+        query = query.filter(EmailOutbox.id.in_(email_ids))
+    batch = (
+        query
+        .order_by(EmailOutbox.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for email in batch:
+        email.status = 'sending'
+        email.next_attempt_at = now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+    db.session.commit()
+    return batch
+
+
+def outbox_message(email):
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = email.subject
+    msg['From'] = email.sender
+    msg['To'] = email.to_email
+    msg.attach(MIMEText(email.text_body or '', 'plain'))
+    msg.attach(MIMEText(email.html_body or '', 'html'))
+    return msg
+
+
+def record_outbox_failure(email, error):
+    email.attempts = (email.attempts or 0) + 1
+    email.last_error = str(error)
+    if email.attempts >= OUTBOX_MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.status = 'pending'
+        backoff = min(OUTBOX_BASE_BACKOFF_SECONDS * 2 ** (email.attempts - 1), OUTBOX_MAX_BACKOFF_SECONDS)
+        email.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+
+
+def deliver_outbox(batch_size=OUTBOX_BATCH_SIZE, max_batches=None, email_ids=None):
+    """Send every due outbox email (or up to max_batches batches, or only `email_ids`) over pooled connections.
+
+    Returns how many were sent.
+    """
+    sent = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batches += 1
+        batch = claim_outbox_batch(batch_size, email_ids)
+        if not batch:
+            return sent
+
+        pending = list(batch)
+        try:
+            with smtp_pool.connection() as server:
+                while pending:
+                    email = pending[0]
+                    try:
+                        server.send_message(outbox_message(email))
+                    except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+                        # The server rejected this message but the connection is still usable
+                        record_outbox_failure(email, e)
+                    else:
+                        email.status = 'sent'
+                        email.sent_at = datetime.utcnow()
+                        email.attempts = (email.attempts or 0) + 1
+                        sent += 1
+                    pending.pop(0)
+        except (smtplib.SMTPException, OSError) as e:
+            # Connection-level failure: back off everything left in the batch and stop for now
+            for email in pending:
+                record_outbox_failure(email, e)
+            db.session.commit()
+            return sent
+        db.session.commit()
+    return sent
+
+
+# Vercel's time limit caps one run; whatever is left stays due for the next one
+CRON_OUTBOX_MAX_BATCHES = int(os.getenv('CRON_OUTBOX_MAX_BATCHES', 10))
+
+
+@app.route('/cron/outbox', methods=['GET', 'POST'])
+@cron_required
+def cron_deliver_outbox():
+    return jsonify({'sent': deliver_outbox(max_batches=CRON_OUTBOX_MAX_BATCHES)})
+
+
 def generate_verification_token():
     """Generate a secure random token for email verification"""
     return secrets.token_urlsafe(32)
@@ -357,6 +893,24 @@ def login_page_role(role):
         return redirect(url_for('login_page'))
     return render_template('login.html', role=role)
 
+# Raise the cost (e.g. scrypt:65536:8:1) and existing hashes are upgraded on each user's next login
+password_hasher = PasswordHasher(os.getenv('PASSWORD_HASH_METHOD', DEFAULT_PASSWORD_HASH_METHOD))
+
+
+def authenticate(email, password):
+    """Find the user through the unique email index and verify the password; stale hashes are upgraded"""
+    user = User.query.filter_by(email=email).first()
+    matches, needs_rehash = password_hasher.verify(user.password if user else None, password)
+    if not matches:
+        return None
+    if db.session.get(UserPurge, user.id):
+        return None  # Queued for deletion; the account is gone as far as logins are concerned
+    if needs_rehash:
+        user.password = password_hasher.hash(password)
+        db.session.commit()
+    return user
+
+
 @app.route('/register', methods=['POST'])
 def register():
     email = request.form['email']
@@ -378,7 +932,7 @@ def register():
         user = User(
             name=name,
             email=email,
-            password=password,
+            password=password_hasher.hash(password),
             role=role,
             email_verified=False,
             verification_token=token,
@@ -407,7 +961,7 @@ def register():
         user = User(
             name=name,
             email=email,
-            password=password,
+            password=password_hasher.hash(password),
             role=role,
             email_verified=True  
         )
@@ -429,10 +983,7 @@ def db_test():
 
 @app.route('/login', methods=['POST'])
 def login():
-    user = User.query.filter_by(
-        email=request.form['email'],
-        password=request.form['password']
-    ).first()
+    user = authenticate(request.form['email'], request.form['password'])
     
     if not user:
         return render_template('login.html', message='Invalid login credentials', role=request.form.get('role'))
@@ -527,20 +1078,67 @@ def admin_assign_course():
     return redirect(url_for('admin_dashboard'))
 
 
+API_STUDENTS_PAGE_SIZE = 50
+API_STUDENTS_MAX_PAGE_SIZE = 200
+
+
+def students_by_course(course_ids, limit=None, after_id=None):
+    """Map each course id to its enrolled students (ordered by id) with a single query.
+
+    With a limit, only the first `limit` students after `after_id` are kept per course.
+    """
+    students = {course_id: [] for course_id in course_ids}
+    if not course_ids:
+        return students
+
+    enrollments = db.session.query(
+        Enrollment.course_id.label('course_id'),
+        Enrollment.student_id.label('student_id'),
+        db.func.row_number().over(
+            partition_by=Enrollment.course_id,
+            order_by=Enrollment.student_id
+        ).label('rank')
+    ).filter(Enrollment.course_id.in_(course_ids))
+    if after_id is not None:
+        enrollments = enrollments.filter(Enrollment.student_id > after_id)
+    enrollments = enrollments.subquery()
+
+    query = (
+        db.session.query(enrollments.c.course_id, User)
+        .join(User, User.id == enrollments.c.student_id)
+        .order_by(enrollments.c.course_id, User.id)
+    )
+    if limit is not None:
+        query = query.filter(enrollments.c.rank <= limit)
+
+    for course_id, student in query.all():
+        students[course_id].append(student)
+    return students
+
+
+def student_counts_by_course(course_ids):
+    """Count enrollments for several courses with one GROUP BY"""
+    if not course_ids:
+        return {}
+    rows = (
+        db.session.query(Enrollment.course_id, db.func.count(Enrollment.id))
+        .filter(Enrollment.course_id.in_(course_ids))
+        .group_by(Enrollment.course_id)
+        .all()
+    )
+    return dict(rows)
+
+
 @app.route('/teacher/<int:id>')
 @role_required('teacher')
 def teacher_dashboard(id):
 
     teacher_courses = Course.query.filter_by(teacher_id=id).all()
-    
+    course_students = students_by_course([course.id for course in teacher_courses])
+
     course_data = []
     for course in teacher_courses:
-        students = (
-            db.session.query(User)
-            .join(Enrollment, User.id == Enrollment.student_id)
-            .filter(Enrollment.course_id == course.id)
-            .all()
-        )
+        students = course_students[course.id]
         course_data.append({
             'course': course,
             'students': students,
@@ -560,36 +1158,307 @@ def teacher_students(id):
     return redirect(url_for('teacher_dashboard', id=id) + '#studentsModal')
 
 
+ADMIN_USERS_PAGE_SIZE = 50
+ADMIN_COURSES_PAGE_SIZE = 50
+ADMIN_TEACHER_CHOICES = 200  # Beyond this the assign forms take a teacher id instead of listing every teacher
+
+
+def admin_stats():
+    """Dashboard counters computed in SQL: one GROUP BY over roles plus the revenue SUM"""
+    role_counts = dict(
+        db.session.query(User.role, db.func.count(User.id)).group_by(User.role).all()
+    )
+    total_revenue = db.session.query(db.func.sum(RevenueRollup.revenue)).scalar() or 0
+
+    return {
+        'total_users': sum(role_counts.values()),
+        'students': role_counts.get('student', 0),
+        'teachers': role_counts.get('teacher', 0),
+        'admins': role_counts.get('admin', 0),
+        'total_revenue': total_revenue,
+        'total_courses': Course.query.count()
+    }
+
+
+REVENUE_REPORT_DEFAULT_DAYS = 30
+
+
+def completion_day():
+    # Completed payments are stamped with updated_at when they complete
+    return db.type_coerce(db.func.date(db.func.coalesce(Payment.updated_at, Payment.created_at)), db.Date)
+
+
+def rebuild_revenue_rollups(course_ids=None):
+    """Recompute revenue rollups from completed payments for some courses (all when None)"""
+    rollups = RevenueRollup.query
+    payments = Payment.query.filter(Payment.status == 'completed')
+    if course_ids is not None:
+        rollups = rollups.filter(RevenueRollup.course_id.in_(course_ids))
+        payments = payments.filter(Payment.course_id.in_(course_ids))
+    rollups.delete(synchronize_session=False)
+
+    day = completion_day()
+    currency = db.func.coalesce(Payment.currency, 'INR')
+    rows = (
+        payments.with_entities(
+            Payment.course_id, day, currency, db.func.count(Payment.id), db.func.coalesce(db.func.sum(Payment.amount), 0)
+        )
+        .filter(Payment.course_id.isnot(None))
+        .group_by(Payment.course_id, day, currency)
+        .all()
+    )
+    if rows:
+        db.session.execute(insert(RevenueRollup), [
+            dict(zip(('course_id', 'day', 'currency', 'payment_count', 'revenue'), row)) for row in rows
+        ])
+
+
+REVENUE_ROLLUP_RETRIES = 2
+
+
+def record_revenue(payment):
+    """Add one completed payment to its (course, day, currency) rollup"""
+    key = {
+        'course_id': payment.course_id,
+        'day': (payment.updated_at or datetime.utcnow()).date(),
+        'currency': payment.currency or 'INR',
+    }
+    amount = payment.amount or 0
+    for attempt in range(REVENUE_ROLLUP_RETRIES):
+        result = db.session.execute(
+            update(RevenueRollup)
+            .where(*[getattr(RevenueRollup, column) == value for column, value in key.items()])
+            .values(payment_count=RevenueRollup.payment_count + 1, revenue=RevenueRollup.revenue + amount)
+        )
+        if result.rowcount:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(RevenueRollup(payment_count=1, revenue=amount, **key))
+            return
+        except IntegrityError:
+            # Another worker opened this day's row first; add to it instead. Giving up silently would
+            # drop the payment from the rollup, so the last failure propagates and the event is retried
+            if attempt == REVENUE_ROLLUP_RETRIES - 1:
+                raise
+
+
+def render_admin_dashboard(**extra):
+    """Render admin.html with one page of users; extra kwargs such as error pass straight through"""
+    users_page = max(request.args.get('users_page', 1, type=int), 1)
+    users = (
+        User.query.order_by(User.id)
+        .limit(ADMIN_USERS_PAGE_SIZE + 1)
+        .offset((users_page - 1) * ADMIN_USERS_PAGE_SIZE)
+        .all()
+    )
+    users_has_next = len(users) > ADMIN_USERS_PAGE_SIZE
+    purges = {
+        purge.user_id: purge for purge in
+        UserPurge.query.filter(UserPurge.user_id.in_([user.id for user in users]))
+    } if users else {}
+
+    payments = Payment.query.order_by(Payment.created_at.desc()).limit(10).all()
+
+    # Courses page like users; teacher names come from the same join the catalog uses
+    courses_page = max(request.args.get('courses_page', 1, type=int), 1)
+    courses = with_teacher_names(
+        Course.query.order_by(Course.id),
+        limit=ADMIN_COURSES_PAGE_SIZE + 1,
+        offset=(courses_page - 1) * ADMIN_COURSES_PAGE_SIZE
+    )
+    courses_has_next = len(courses) > ADMIN_COURSES_PAGE_SIZE
+
+    teachers = (
+        db.session.query(User.id, User.name)
+        .filter(User.role == 'teacher')
+        .order_by(User.name, User.id)
+        .limit(ADMIN_TEACHER_CHOICES + 1)
+        .all()
+    )
+    teachers_truncated = len(teachers) > ADMIN_TEACHER_CHOICES
+
+    return render_template('admin.html',
+                          users=users[:ADMIN_USERS_PAGE_SIZE],
+                          users_page=users_page,
+                          users_has_next=users_has_next,
+                          purges=purges,
+                          stats=admin_stats(),
+                          payments=payments,
+                          courses=courses[:ADMIN_COURSES_PAGE_SIZE],
+                          courses_page=courses_page,
+                          courses_has_next=courses_has_next,
+                          teachers=teachers[:ADMIN_TEACHER_CHOICES],
+                          teachers_truncated=teachers_truncated,
+                          **extra)
+
+
 @app.route('/admin')
 @role_required('admin')
 def admin_dashboard():
-    users = User.query.all()
-    payments = Payment.query.order_by(Payment.created_at.desc()).limit(10).all()
-    courses = Course.query.all()
-    teachers = User.query.filter_by(role='teacher').all()
-    
-           
-    total_revenue = db.session.query(db.func.sum(Payment.amount)).filter(Payment.status == 'completed').scalar() or 0
-    total_courses = Course.query.count()
+    return render_admin_dashboard()
 
-    
-    teacher_map = {t.id: t.name for t in teachers}
 
-    stats = {
-        'total_users': len(users),
-        'students': len([u for u in users if u.role == 'student']),
-        'teachers': len(teachers),
-        'admins': len([u for u in users if u.role == 'admin']),
-        'total_revenue': total_revenue,
-        'total_courses': total_courses
-    }
-    return render_template('admin.html', 
-                          users=users, 
-                          stats=stats, 
-                          payments=payments, 
-                          courses=courses, 
-                          teachers=teachers,
-                          teacher_map=teacher_map)
+@app.route('/admin/reports/revenue', methods=['GET'])
+@role_required('admin')
+def admin_revenue_report():
+    """Revenue per course and day from the rollup table; ?start=&end= (YYYY-MM-DD) and ?course_id= narrow it"""
+    try:
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else datetime.utcnow().date()
+        start = (datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start')
+                 else end - timedelta(days=REVENUE_REPORT_DEFAULT_DAYS - 1))
+    except ValueError:
+        return jsonify({'error': 'start and end must be YYYY-MM-DD'}), 400
+
+    query = (
+        db.session.query(RevenueRollup, Course.title)
+        .outerjoin(Course, Course.id == RevenueRollup.course_id)
+        .filter(RevenueRollup.day >= start, RevenueRollup.day <= end)
+    )
+    course_id = request.args.get('course_id', type=int)
+    if course_id:
+        query = query.filter(RevenueRollup.course_id == course_id)
+
+    rows = []
+    totals = {}
+    for rollup, title in query.order_by(RevenueRollup.day, RevenueRollup.course_id).all():
+        rows.append({
+            'day': rollup.day.isoformat(),
+            'course_id': rollup.course_id,
+            'course_title': title,
+            'currency': rollup.currency,
+            'payments': rollup.payment_count,
+            'revenue': float(rollup.revenue),
+        })
+        total = totals.setdefault(rollup.currency, {'payments': 0, 'revenue': 0.0})
+        total['payments'] += rollup.payment_count
+        total['revenue'] += float(rollup.revenue)
+
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'totals': totals,
+        'rows': rows
+    })
+
+
+# Exports stream straight from a server-side cursor, so memory stays flat however many rows there are
+EXPORT_CHUNK_ROWS = 2000
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_DATASETS = {
+    'enrollments': (
+        Enrollment.id, Enrollment.student_id, User.name.label('student_name'), User.email.label('student_email'),
+        Enrollment.course_id, Course.title.label('course_title'), Enrollment.enrolled_at,
+    ),
+    'payments': (
+        Payment.id, Payment.student_id, Payment.course_id, Payment.amount, Payment.currency, Payment.status,
+        Payment.payment_gateway, Payment.payment_method, Payment.order_id, Payment.transaction_id,
+        Payment.created_at, Payment.updated_at,
+    ),
+    'quiz-attempts': (
+        QuizAttempt.id, QuizAttempt.quiz_id, Quiz.title.label('quiz_title'), Quiz.course_id, QuizAttempt.student_id,
+        User.name.label('student_name'), QuizAttempt.score, QuizAttempt.max_score, QuizAttempt.percentage,
+        QuizAttempt.passed, QuizAttempt.started_at, QuizAttempt.submitted_at,
+    ),
+}
+
+
+def export_query(dataset, teacher_id=None):
+    """Rows for one export in id order; teachers only see their own courses and quizzes"""
+    columns = EXPORT_DATASETS[dataset]
+    query = db.session.query(*columns)
+    if dataset == 'enrollments':
+        query = (query.join(User, User.id == Enrollment.student_id)
+                 .join(Course, Course.id == Enrollment.course_id))
+        if teacher_id is not None:
+            query = query.filter(Course.teacher_id == teacher_id)
+        model = Enrollment
+    elif dataset == 'payments':
+        if teacher_id is not None:
+            query = query.join(Course, Course.id == Payment.course_id).filter(Course.teacher_id == teacher_id)
+        model = Payment
+    else:
+        query = (query.join(Quiz, Quiz.id == QuizAttempt.quiz_id)
+                 .outerjoin(User, User.id == QuizAttempt.student_id)
+                 .filter(QuizAttempt.submitted_at.isnot(None)))
+        if teacher_id is not None:
+            query = query.filter(Quiz.created_by == teacher_id)
+        model = QuizAttempt
+
+    course_id = request.args.get('course_id', type=int)
+    if course_id:
+        query = query.filter((Quiz.course_id if model is QuizAttempt else model.course_id) == course_id)
+    # ?after=<id> resumes an interrupted download
+    after = request.args.get('after', type=int)
+    if after:
+        query = query.filter(model.id > after)
+    return [column.key for column in columns], query.order_by(model.id).yield_per(EXPORT_CHUNK_ROWS)
+
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def stream_export(names, rows, fmt):
+    """Encode rows as CSV or NDJSON, one response chunk per EXPORT_CHUNK_ROWS rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(names)
+    count = 0
+    for row in rows:
+        values = [export_value(value) for value in row]
+        if writer:
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(names, values))))
+            buffer.write('\n')
+        count += 1
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_response(dataset, teacher_id=None):
+    fmt = request.args.get('format', 'csv')
+    if dataset not in EXPORT_DATASETS or fmt not in EXPORT_FORMATS:
+        return jsonify({
+            'error': f"Unknown export; datasets: {', '.join(EXPORT_DATASETS)}; formats: {', '.join(EXPORT_FORMATS)}"
+        }), 404
+    names, rows = export_query(dataset, teacher_id)
+    filename = f"{dataset}-{datetime.utcnow().strftime('%Y%m%d')}.{fmt}"
+    return Response(
+        stream_with_context(stream_export(names, rows, fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Accel-Buffering': 'no',  # Let proxies pass chunks through instead of buffering the whole body
+        }
+    )
+
+
+@app.route('/admin/export/<dataset>', methods=['GET'])
+@role_required('admin')
+def admin_export(dataset):
+    """Stream enrollments, payments or quiz-attempts; ?format=csv|ndjson, ?course_id=, ?after=<last id>"""
+    return export_response(dataset)
+
+
+@app.route('/teacher/<int:id>/export/<dataset>', methods=['GET'])
+@role_required('teacher')
+def teacher_export(id, dataset):
+    """Same as admin_export, limited to the teacher's own courses and quizzes"""
+    if id != session.get('id') and session.get('role') != 'admin':
+        flash('Unauthorized')
+        return redirect(url_for('home'))
+    return export_response(dataset, teacher_id=id)
 
 
 @app.route('/admin/create-user', methods=['POST'])
@@ -601,37 +1470,220 @@ def admin_create_user():
     role = request.form.get('role', 'student').strip()
 
     if not name or not email or not password:
-        users = User.query.all()
-        return render_template('admin.html',
-                             users=users,
-                             stats={
-                                 'total_users': len(users),
-                                 'students': len([u for u in users if u.role == 'student']),
-                                 'teachers': len([u for u in users if u.role == 'teacher']),
-                                 'admins': len([u for u in users if u.role == 'admin']),
-                                 'total_revenue': 0, # Simplified for error case
-                                 'total_courses': 0
-                             },
-                             error='All fields are required')
+        return render_admin_dashboard(error='All fields are required')
 
     if User.query.filter_by(email=email).first():
-        return render_template('admin.html',
-                             users=User.query.all(),
-                             stats={
-                                 'total_users': len(User.query.all()),
-                                 'students': len([u for u in User.query.all() if u.role == 'student']),
-                                 'teachers': len([u for u in User.query.all() if u.role == 'teacher']),
-                                 'admins': len([u for u in User.query.all() if u.role == 'admin'])
-                             },
-                             error='Email already exists')
-
-    user = User(name=name, email=email, password=password, role=role)
+        return render_admin_dashboard(error='Email already exists')
+
+    user = User(name=name, email=email, password=password_hasher.hash(password), role=role)
     db.session.add(user)
     db.session.commit()
 
     return redirect(url_for('admin_dashboard'))
 
 
+NOTIFY_CHUNK_SIZE = 1000
+
+
+@app.route('/admin/notify', methods=['POST'])
+@role_required('admin')
+def admin_notify():
+    role = request.form.get('role', '').strip()
+    subject = request.form.get('subject', '').strip()
+    # Textareas submit CRLF line endings; the templates split paragraphs on blank lines
+    message = request.form.get('message', '').replace('\r\n', '\n').replace('\r', '\n').strip()
+
+    if role not in ('student', 'teacher') or not subject or not message:
+        return render_admin_dashboard(error='Choose an audience and enter a subject and message')
+
+    recipients = (
+        db.session.query(User.email, User.name)
+        .filter(User.role == role)
+        .execution_options(yield_per=NOTIFY_CHUNK_SIZE)
+    )
+    queued = 0
+    chunk = []
+    for email, name in recipients:
+        chunk.append((email, {'name': name, 'subject': subject, 'message': message}))
+        if len(chunk) == NOTIFY_CHUNK_SIZE:
+            db.session.execute(insert(EmailOutbox), render_emails('announcement', chunk))
+            queued += len(chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(EmailOutbox), render_emails('announcement', chunk))
+        queued += len(chunk)
+    db.session.commit()
+    schedule_outbox_delivery()
+
+    return render_admin_dashboard(message=f'Queued {queued} emails to {role}s')
+
+
+# Cascades are a handful of set-based DELETEs keyed by subqueries, never per-row loops
+PURGE_CHUNK_SIZE = 5000
+PURGE_MAX_ATTEMPTS = 5
+PURGE_BASE_BACKOFF_SECONDS = 60
+# A purge that dies midway (or hits the serverless time limit) becomes due again after this lease;
+# chunks already committed stay deleted, so the retry picks up where it stopped
+PURGE_LEASE_SECONDS = 600
+# Run queued purges on a thread right away; off on Vercel, where /cron/purges or purge_worker.py drains them
+app.config['PURGE_BACKGROUND'] = os.getenv('PURGE_BACKGROUND', '0' if is_vercel else '1') == '1'
+purge_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='purge')
+
+
+def delete_in_chunks(model, condition, chunk_size=PURGE_CHUNK_SIZE, max_chunks=None):
+    """Delete matching rows `chunk_size` at a time (at most `max_chunks` chunks), committing each chunk so no
+    transaction runs long"""
+    removed = 0
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        chunks += 1
+        ids = [row_id for (row_id,) in db.session.query(model.id).filter(condition).limit(chunk_size)]
+        if not ids:
+            return removed
+        model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        removed += len(ids)
+    return removed
+
+
+def delete_quizzes(quiz_ids):
+    """Delete quizzes and everything hanging off them; `quiz_ids` may be a list or a select of ids.
+
+    Returns the deleted quiz ids so callers can drop their cache entries after committing.
+    """
+    deleted = [quiz_id for (quiz_id,) in db.session.query(Quiz.id).filter(Quiz.id.in_(quiz_ids))]
+    if not deleted:
+        return deleted
+    for model in (Question, QuizAttempt, QuizSummary):
+        model.query.filter(model.quiz_id.in_(deleted)).delete(synchronize_session=False)
+    Quiz.query.filter(Quiz.id.in_(deleted)).delete(synchronize_session=False)
+    return deleted
+
+
+def delete_courses(course_ids):
+    """Delete courses with their quizzes, enrollments, payments and materials; returns the deleted quiz ids"""
+    deleted_quizzes = delete_quizzes(db.select(Quiz.id).where(Quiz.course_id.in_(course_ids)))
+    for model in (Enrollment, Payment, CourseMaterial, RevenueRollup):
+        model.query.filter(model.course_id.in_(course_ids)).delete(synchronize_session=False)
+    Course.query.filter(Course.id.in_(course_ids)).delete(synchronize_session=False)
+    return deleted_quizzes
+
+
+def delete_user_account(user_id):
+    """Delete a user and all their student and teacher data; returns the deleted quiz ids"""
+    attempted_quiz_ids = [
+        quiz_id for (quiz_id,) in
+        db.session.query(QuizAttempt.quiz_id).filter_by(student_id=user_id).distinct()
+    ]
+    paid_course_ids = [
+        course_id for (course_id,) in
+        db.session.query(Payment.course_id).filter_by(student_id=user_id, status='completed').distinct()
+    ]
+    for model in (Enrollment, Payment, QuizAttempt):
+        model.query.filter(model.student_id == user_id).delete(synchronize_session=False)
+    if paid_course_ids:
+        rebuild_revenue_rollups(paid_course_ids)
+
+    deleted_quizzes = delete_courses(db.select(Course.id).where(Course.teacher_id == user_id))
+    deleted_quizzes += delete_quizzes(db.select(Quiz.id).where(Quiz.created_by == user_id))
+
+    # Quizzes the user only took keep their rollups, minus this user's attempts
+    rebuild_quiz_summaries([quiz_id for quiz_id in attempted_quiz_ids if quiz_id not in deleted_quizzes])
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
+    UserPurge.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    return deleted_quizzes
+
+
+def purge_user(user_id):
+    """Delete a large account: big child tables go first in short chunked transactions, then the cheap cascade"""
+    owned_courses = db.select(Course.id).where(Course.teacher_id == user_id)
+    owned_quizzes = db.select(Quiz.id).where(db.or_(
+        Quiz.created_by == user_id, Quiz.course_id.in_(owned_courses)
+    ))
+    for model, condition in (
+        (QuizAttempt, QuizAttempt.quiz_id.in_(owned_quizzes)),
+        (Question, Question.quiz_id.in_(owned_quizzes)),
+        (Enrollment, Enrollment.course_id.in_(owned_courses)),
+        (Payment, Payment.course_id.in_(owned_courses)),
+    ):
+        delete_in_chunks(model, condition)
+    deleted_quizzes = delete_user_account(user_id)
+    db.session.commit()
+    for quiz_id in deleted_quizzes:
+        drop_cached_quiz(quiz_id)
+
+
+def queue_user_purge(user_id):
+    """Mark a user as pending deletion; re-queuing a failed purge resets it for another round of attempts"""
+    purge = db.session.get(UserPurge, user_id)
+    if purge is None:
+        db.session.add(UserPurge(user_id=user_id))
+    else:
+        purge.status = 'pending'
+        purge.attempts = 0
+        purge.next_attempt_at = datetime.utcnow()
+    db.session.commit()
+    if app.config['PURGE_BACKGROUND']:
+        purge_executor.submit(process_user_purges_in_background)
+
+
+def process_user_purges_in_background():
+    with app.app_context():
+        try:
+            process_user_purges()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception(f"Error processing user purges: {e}")
+
+
+def claim_user_purges(batch_size):
+    now = datetime.utcnow()
+    batch = (
+        UserPurge.query
+        .filter(UserPurge.status.in_(('pending', 'running')), UserPurge.next_attempt_at <= now)
+        .order_by(UserPurge.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for purge in batch:
+        purge.status = 'running'
+        purge.attempts = (purge.attempts or 0) + 1
+        purge.next_attempt_at = now + timedelta(seconds=PURGE_LEASE_SECONDS)
+    db.session.commit()
+    return [(purge.user_id, purge.attempts) for purge in batch]
+
+
+def process_user_purges(batch_size=5):
+    """Finish every due queued purge; failures stay visible on the admin dashboard. Returns how many finished."""
+    finished = 0
+    while True:
+        claimed = claim_user_purges(batch_size)
+        if not claimed:
+            return finished
+        for user_id, attempts in claimed:
+            try:
+                purge_user(user_id)
+                finished += 1
+            except Exception as e:
+                db.session.rollback()
+                app.logger.exception(f"Error purging user {user_id}: {e}")
+                db.session.execute(
+                    update(UserPurge).where(UserPurge.user_id == user_id).values(
+                        status='failed' if attempts >= PURGE_MAX_ATTEMPTS else 'pending',
+                        last_error=str(e),
+                        next_attempt_at=datetime.utcnow() + timedelta(seconds=PURGE_BASE_BACKOFF_SECONDS * 2 ** (attempts - 1))
+                    )
+                )
+                db.session.commit()
+
+
+@app.route('/cron/purges', methods=['GET', 'POST'])
+@cron_required
+def cron_process_user_purges():
+    return jsonify({'purged': process_user_purges()})
+
+
 @app.route('/admin/delete-user/<int:user_id>', methods=['POST'])
 @role_required('admin')
 def admin_delete_user(user_id):
@@ -640,41 +1692,18 @@ def admin_delete_user(user_id):
         flash('User not found.')
         return redirect(url_for('admin_dashboard'))
 
+    if request.form.get('background'):
+        queue_user_purge(user_id)
+        flash(f'User {user.email} is queued for deletion; progress and any errors show in the user list.')
+        return redirect(url_for('admin_dashboard'))
+
+    email = user.email
     try:
-        # 1. Delete Student Data (if user acted as student)
-        Enrollment.query.filter_by(student_id=user_id).delete()
-        Payment.query.filter_by(student_id=user_id).delete()
-        QuizAttempt.query.filter_by(student_id=user_id).delete()
-
-        # 2. Delete Teacher Data (if user acted as teacher)
-        # Find all courses by this teacher
-        teacher_courses = Course.query.filter_by(teacher_id=user_id).all()
-        for course in teacher_courses:
-            # Delete enrollments for this course
-            Enrollment.query.filter_by(course_id=course.id).delete()
-            # Delete payments for this course
-            Payment.query.filter_by(course_id=course.id).delete()
-            # Delete quizzes for this course (and questions)
-            quizzes = Quiz.query.filter_by(course_id=course.id).all()
-            for quiz in quizzes:
-                Question.query.filter_by(quiz_id=quiz.id).delete()
-                QuizAttempt.query.filter_by(quiz_id=quiz.id).delete()
-                db.session.delete(quiz)
-            
-            # Delete the course itself
-            db.session.delete(course)
-        
-        # Delete any standalone quizzes created by this user
-        other_quizzes = Quiz.query.filter_by(created_by=user_id).all()
-        for quiz in other_quizzes:
-             Question.query.filter_by(quiz_id=quiz.id).delete()
-             QuizAttempt.query.filter_by(quiz_id=quiz.id).delete()
-             db.session.delete(quiz)
-
-        # 3. Delete the User
-        db.session.delete(user)
+        deleted_quizzes = delete_user_account(user_id)
         db.session.commit()
-        flash(f'User {user.email} and all associated data deleted successfully!')
+        for quiz_id in deleted_quizzes:
+            drop_cached_quiz(quiz_id)
+        flash(f'User {email} and all associated data deleted successfully!')
 
     except Exception as e:
         db.session.rollback()
@@ -689,41 +1718,79 @@ def teacher_student_detail(teacher_id, student_id):
     return redirect(url_for('teacher_dashboard', id=teacher_id) + '#studentsModal')
 
 
-@app.route('/course/<int:course_id>/material/delete/<int:material_index>', methods=['POST'])
+def upload_material_file(uploader, file, course_id):
+    """Upload one course file; runs on upload_executor so several files go up at once"""
+    # Upload to Cloudinary using 'auto' for better delivery
+    return uploader(
+        file,
+        folder=f"course_materials/{course_id}",
+        resource_type="auto",
+        use_filename=True,
+        unique_filename=True
+    )
+
+
+def course_materials(course_id):
+    """Materials for one course in display order, read through the (course_id, position) index"""
+    return (
+        CourseMaterial.query
+        .filter_by(course_id=course_id)
+        .order_by(CourseMaterial.position, CourseMaterial.id)
+        .all()
+    )
+
+
+MATERIAL_POSITION_RETRIES = 5
+
+
+def next_material_position(course_id):
+    last = db.session.query(db.func.max(CourseMaterial.position)).filter_by(course_id=course_id).scalar()
+    return (last or 0) + 1
+
+
+def add_material(course_id, position=None, **fields):
+    """Save one material at `position` (default: the end of the course) and commit it.
+
+    Concurrent uploads can read the same MAX(position); the unique (course_id, position)
+    index rejects the loser, which re-reads the end of the list and tries again. A taken
+    `position` falls back to appending the same way.
+    """
+    for attempt in range(MATERIAL_POSITION_RETRIES):
+        if position is None or attempt:
+            position = next_material_position(course_id)
+        material = CourseMaterial(course_id=course_id, position=position, **fields)
+        db.session.add(material)
+        try:
+            db.session.commit()
+            return material
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == MATERIAL_POSITION_RETRIES - 1:
+                raise
+
+
+@app.route('/course/<int:course_id>/material/delete/<int:material_id>', methods=['POST'])
 @role_required('teacher')
-def delete_material(course_id, material_index):
+def delete_material(course_id, material_id):
     course = Course.query.get(course_id)
     if not course:
         flash('Course not found')
         return redirect(url_for('teacher_dashboard', id=session.get('id')))
-    
-    materials_list = []
-    materials_list = []
-    if course.materials:
-        try:
-            materials_list = json.loads(course.materials)
-        except:
-            materials_list = []
-    
-    if 0 <= material_index < len(materials_list):
-        
-        material = materials_list[material_index]
-        if material.get('type') == 'file':
+
+    material = CourseMaterial.query.filter_by(id=material_id, course_id=course_id).first()
+    if material:
+        if material.type == 'file':
             try:
-                
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], material['path'].split('/')[-1])
+                filepath = os.path.join(app.config['UPLOAD_FOLDER'], material.path.split('/')[-1])
                 if os.path.exists(filepath):
                     os.remove(filepath)
             except Exception as e:
                 print(f"Error deleting file: {e}")
-        
-        
-        materials_list.pop(material_index)
-        course.materials = json.dumps(materials_list)
-        db.session.add(course)
+
+        db.session.delete(material)
         db.session.commit()
         flash('Material deleted successfully!', 'success')
-    
+
     return redirect(url_for('edit_course_materials', course_id=course_id))
 
 
@@ -735,6 +1802,13 @@ def create_course():
     teacher_id = request.form.get('teacher_id')
     price = request.form.get('price', 0)
 
+    # The form takes a typed teacher id once there are too many teachers to list
+    if teacher_id and teacher_id != '0':
+        teacher = db.session.get(User, int(teacher_id)) if teacher_id.isdigit() else None
+        if not teacher or teacher.role != 'teacher':
+            flash('Invalid teacher selection')
+            return redirect(url_for('admin_dashboard'))
+
     course = Course(
         title=title,
         description=description,
@@ -754,6 +1828,62 @@ def create_course():
     return redirect(url_for('admin_dashboard'))
 
 
+# Stripe accepts 30 minutes to 24 hours; sessions close to expiry are replaced rather than reused
+CHECKOUT_SESSION_TTL = timedelta(hours=int(os.getenv('CHECKOUT_SESSION_TTL_HOURS', 23)))
+CHECKOUT_REUSE_MARGIN = timedelta(minutes=10)
+# Stripe's own default lifetime, for pending rows written before expires_at was recorded
+LEGACY_CHECKOUT_TTL = timedelta(hours=24)
+
+
+def checkout_expiry(payment):
+    return payment.expires_at or (payment.created_at or datetime.utcnow()) + LEGACY_CHECKOUT_TTL
+
+
+def expire_checkout_session(order_id):
+    """Close a Stripe session we are replacing so it can't be paid as well.
+
+    Returns the session as Stripe now has it: status 'expired', or 'complete' if the student paid first.
+    None means Stripe couldn't be asked, so the session may still be open.
+    """
+    try:
+        return stripe.checkout.Session.expire(order_id)
+    except stripe.error.InvalidRequestError:
+        # Only open sessions can be expired; find out whether this one was paid or had already lapsed
+        try:
+            return stripe.checkout.Session.retrieve(order_id)
+        except Exception as e:
+            print(f"Error retrieving checkout session {order_id}: {e}")
+    except Exception as e:
+        print(f"Error expiring checkout session {order_id}: {e}")
+    return None
+
+
+def create_checkout_session(course, student_id, expires_at):
+    return stripe.checkout.Session.create(
+        payment_method_types=['card'],
+        line_items=[{
+            'price_data': {
+                'currency': course.currency.lower() if course.currency else 'inr',
+                'product_data': {
+                    'name': course.title,
+                    'description': course.description[:255] if course.description else None,
+                },
+                'unit_amount': int(course.price * 100),
+            },
+            'quantity': 1,
+        }],
+        mode='payment',
+        success_url=url_for('payment_success', _external=True) + '?session_id={CHECKOUT_SESSION_ID}',
+        cancel_url=url_for('payment_cancel', _external=True),
+        client_reference_id=str(student_id),
+        expires_at=int(expires_at.replace(tzinfo=timezone.utc).timestamp()),
+        metadata={
+            'course_id': str(course.id),
+            'student_id': str(student_id)
+        }
+    )
+
+
 @app.route('/course/<int:course_id>/payment/initiate', methods=['POST'])
 @role_required('student')
 def initiate_payment(course_id):
@@ -766,30 +1896,31 @@ def initiate_payment(course_id):
         flash('You are already enrolled in this course.')
         return redirect(url_for('student_dashboard', id=student_id))
     
+    now = datetime.utcnow()
+    pending = Payment.query.filter_by(student_id=student_id, course_id=course_id, status='pending').first()
+    if pending and pending.checkout_url and checkout_expiry(pending) > now + CHECKOUT_REUSE_MARGIN:
+        return redirect(pending.checkout_url, code=303)
+    
     try:
+        if pending:
+            # Too close to expiry (or created before URLs were stored): retire it and open a fresh one, but
+            # only once Stripe confirms it can no longer be paid; its webhook may still be on the way
+            closed = expire_checkout_session(pending.order_id)
+            if closed is None or closed.status == 'open':
+                flash('Your previous checkout could not be closed. Please try again in a moment.')
+                return redirect(url_for('student_dashboard', id=student_id))
+            if closed.status == 'complete':
+                if closed.payment_status == 'paid':
+                    finalize_checkout_session(closed)
+                    db.session.commit()
+                # Paid (or an async payment still clearing): report that instead of charging again
+                return redirect(url_for('payment_success', session_id=pending.order_id))
+            pending.status = 'expired'
+            pending.updated_at = now
+            db.session.commit()
         
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
-                'price_data': {
-                    'currency': course.currency.lower() if course.currency else 'inr',
-                    'product_data': {
-                        'name': course.title,
-                        'description': course.description[:255] if course.description else None,
-                    },
-                    'unit_amount': int(course.price * 100),
-                },
-                'quantity': 1,
-            }],
-            mode='payment',
-            success_url=url_for('payment_success', _external=True) + '?session_id={CHECKOUT_SESSION_ID}',
-            cancel_url=url_for('payment_cancel', _external=True),
-            client_reference_id=str(student_id),
-            metadata={
-                'course_id': str(course_id),
-                'student_id': str(student_id)
-            }
-        )
+        expires_at = now + CHECKOUT_SESSION_TTL
+        checkout_session = create_checkout_session(course, student_id, expires_at)
 
         payment = Payment(
             student_id=student_id,
@@ -798,90 +1929,329 @@ def initiate_payment(course_id):
             currency=course.currency,
             payment_gateway='stripe',
             order_id=checkout_session.id,
-            status='pending'
+            status='pending',
+            checkout_url=checkout_session.url,
+            expires_at=expires_at
         )
         db.session.add(payment)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent click won the race; send both to its session and close ours
+            db.session.rollback()
+            expire_checkout_session(checkout_session.id)
+            payment = Payment.query.filter_by(student_id=student_id, course_id=course_id, status='pending').first()
+            if not payment or not payment.checkout_url:
+                raise
         
-        return redirect(checkout_session.url, code=303)
+        return redirect(payment.checkout_url, code=303)
         
     except Exception as e:
+        db.session.rollback()
         flash(f'Error initiating payment: {str(e)}')
         return redirect(url_for('student_dashboard', id=student_id))
 
 
+def expire_stale_payments(chunk_size=PURGE_CHUNK_SIZE, max_chunks=None):
+    """Mark pending payments whose checkout session has lapsed as expired; returns how many changed"""
+    now = datetime.utcnow()
+    stale = db.or_(
+        Payment.expires_at < now,
+        db.and_(Payment.expires_at.is_(None), Payment.created_at < now - LEGACY_CHECKOUT_TTL)
+    )
+    expired = 0
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        chunks += 1
+        ids = [
+            payment_id for (payment_id,) in
+            db.session.query(Payment.id).filter(Payment.status == 'pending', stale).limit(chunk_size)
+        ]
+        if not ids:
+            return expired
+        Payment.query.filter(Payment.id.in_(ids), Payment.status == 'pending').update(
+            {'status': 'expired', 'updated_at': now}, synchronize_session=False
+        )
+        db.session.commit()
+        expired += len(ids)
+    return expired
+
+
 @app.route('/payment/success', methods=['GET'])
 def payment_success():
+    # Enrollment is finalized by the webhook; this page only reports what has been recorded so far
     session_id = request.args.get('session_id')
-    if not session_id:
+    payment = Payment.query.filter_by(order_id=session_id).first() if session_id else None
+    if not payment:
         flash('Invalid payment session.')
         return redirect(url_for('home'))
-        
+
+    if payment.status == 'completed':
+        flash('Payment successful! You are now enrolled.')
+        return redirect(url_for('student_dashboard', id=payment.student_id))
+    if payment.status == 'pending':
+        return render_template('payment-pending.html', session_id=session_id)
+
+    flash('Payment not completed.')
+    return redirect(url_for('home'))
+
+
+STRIPE_EVENT_BATCH_SIZE = 50
+STRIPE_EVENT_MAX_ATTEMPTS = 5
+STRIPE_EVENT_LEASE_SECONDS = 300
+CRON_STRIPE_MAX_BATCHES = 10
+
+
+
+@app.route('/stripe/webhook', methods=['POST'])
+def stripe_webhook():
+    if not stripe_webhook_secret:
+        return jsonify({'error': 'STRIPE_WEBHOOK_SECRET is not configured'}), 500
     try:
-        
-        checkout_session = stripe.checkout.Session.retrieve(session_id)
-        
-        if checkout_session.payment_status == 'paid':
-            
-            payment = Payment.query.filter_by(order_id=session_id).first()
-            if payment:
-                payment.status = 'completed'
-                payment.transaction_id = checkout_session.payment_intent
-                payment.updated_at = datetime.utcnow()
-                
-                
-                existing_enroll = Enrollment.query.filter_by(
-                    student_id=payment.student_id, 
-                    course_id=payment.course_id
-                ).first()
-                
-                if not existing_enroll:
-                    enrollment = Enrollment(student_id=payment.student_id, course_id=payment.course_id)
-                    db.session.add(enrollment)
-                
-                db.session.commit()
-                
-                flash('Payment successful! You are now enrolled.')
-                return redirect(url_for('student_dashboard', id=payment.student_id))
-            else:
-                 
-                 pass
-        
-        flash('Payment not completed.')
-        return redirect(url_for('home'))
-            
+        event = stripe.Webhook.construct_event(
+            request.get_data(), request.headers.get('Stripe-Signature', ''), stripe_webhook_secret
+        )
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        return jsonify({'error': f'Invalid webhook: {e}'}), 400
+
+    # Stripe redelivers until it sees a 2xx, so a duplicate event id is acknowledged, not reprocessed.
+    # The row is stored already claimed, so workers leave it alone while this request applies it.
+    stored = StripeEvent(
+        id=event['id'], type=event['type'], payload=request.get_data(as_text=True),
+        status='processing', processed_at=datetime.utcnow()
+    )
+    db.session.add(stored)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'received': True, 'duplicate': True})
+
+    # This is Stripe's request, not the student's, so it can afford to finalize the payment inline;
+    # a detached thread would be frozen on serverless. If it fails, the lease runs out and
+    # stripe_worker.py or /cron/stripe-events retries it.
+    processed = process_stripe_event(stored)
+    return jsonify({'received': True, 'processed': processed})
+
+
+def claim_stripe_events(batch_size):
+    now = datetime.utcnow()
+    lease_expired = now - timedelta(seconds=STRIPE_EVENT_LEASE_SECONDS)
+    batch = (
+        StripeEvent.query
+        .filter(db.or_(
+            StripeEvent.status == 'pending',
+            db.and_(StripeEvent.status == 'processing', StripeEvent.processed_at < lease_expired)
+        ))
+        .order_by(StripeEvent.received_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for event in batch:
+        # processed_at doubles as the lease start while an event is being worked on
+        event.status = 'processing'
+        event.processed_at = now
+    db.session.commit()
+    return batch
+
+
+def finalize_payment(order_id, transaction_id=None, metadata=None, amount=None, currency=None):
+    """Mark a checkout as paid and enroll the student; safe to call again for the same order"""
+    payment = Payment.query.filter_by(order_id=order_id).first()
+    if not payment:
+        # The pending row can be missing (e.g. deleted by an admin); rebuild it from the session metadata
+        metadata = metadata or {}
+        if not metadata.get('student_id') or not metadata.get('course_id'):
+            return None
+        payment = Payment(
+            student_id=int(metadata['student_id']),
+            course_id=int(metadata['course_id']),
+            amount=amount,
+            currency=currency,
+            payment_gateway='stripe',
+            order_id=order_id
+        )
+        db.session.add(payment)
+    if payment.status == 'completed':
+        return payment
+
+    payment.status = 'completed'
+    payment.transaction_id = transaction_id
+    payment.updated_at = datetime.utcnow()
+    db.session.flush()
+    record_revenue(payment)
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(Enrollment(student_id=payment.student_id, course_id=payment.course_id))
+    except IntegrityError:
+        pass  # Already enrolled
+    return payment
+
+
+def finalize_checkout_session(checkout):
+    """finalize_payment for a paid Checkout Session, from a webhook payload or a session fetched from Stripe"""
+    return finalize_payment(
+        checkout['id'],
+        transaction_id=checkout.get('payment_intent'),
+        metadata=checkout.get('metadata'),
+        amount=(checkout.get('amount_total') or 0) / 100,
+        currency=(checkout.get('currency') or '').upper() or None
+    )
+
+
+def apply_stripe_event(event):
+    data = json.loads(event.payload)['data']['object']
+    if event.type in ('checkout.session.completed', 'checkout.session.async_payment_succeeded'):
+        if data.get('payment_status') == 'paid':
+            finalize_checkout_session(data)
+    elif event.type in ('checkout.session.expired', 'checkout.session.async_payment_failed'):
+        status = 'expired' if event.type == 'checkout.session.expired' else 'failed'
+        Payment.query.filter_by(order_id=data['id'], status='pending').update(
+            {'status': status, 'updated_at': datetime.utcnow()}, synchronize_session=False
+        )
+
+
+def process_stripe_event(event):
+    """Apply one claimed event and record the outcome; returns whether it was processed"""
+    try:
+        apply_stripe_event(event)
     except Exception as e:
-        flash(f'Error verifying payment: {str(e)}')
-        return redirect(url_for('home'))
+        db.session.rollback()
+        event = db.session.get(StripeEvent, event.id)
+        event.attempts = (event.attempts or 0) + 1
+        event.last_error = str(e)
+        # Left in 'processing' the event is retried once its lease runs out, not right away
+        if event.attempts >= STRIPE_EVENT_MAX_ATTEMPTS:
+            event.status = 'failed'
+        db.session.commit()
+        return False
+    event.status = 'processed'
+    event.processed_at = datetime.utcnow()
+    event.attempts = (event.attempts or 0) + 1
+    db.session.commit()
+    return True
+
+
+def process_stripe_events(batch_size=STRIPE_EVENT_BATCH_SIZE, max_batches=None):
+    """Retry stored webhook events the webhook itself couldn't apply; returns how many were processed"""
+    processed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batches += 1
+        batch = claim_stripe_events(batch_size)
+        if not batch:
+            break
+        processed += sum(process_stripe_event(event) for event in batch)
+    return processed
+
+
+@app.route('/cron/stripe-events', methods=['GET', 'POST'])
+@cron_required
+def cron_process_stripe_events():
+    return jsonify({'processed': process_stripe_events(max_batches=CRON_STRIPE_MAX_BATCHES)})
 
 
 @app.route('/payment/cancel', methods=['GET'])
 def payment_cancel():
     return render_template('payment-cancel.html')
 
+CATALOG_PAGE_SIZE = 24
+
+# Must match the expression indexed by migrate_enhanced.py so Postgres can use the GIN index
+COURSE_SEARCH_DOCUMENT = "to_tsvector('english', coalesce(title, '') || ' ' || coalesce(description, ''))"
+
+_course_fts_available = None
+
+
+def like_pattern(term):
+    """Substring pattern for ILIKE with the user's %, _ and \\ matched literally (pair with escape='\\')"""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def course_fts_available():
+    """Check once whether the SQLite FTS5 shadow table has been created by the migration"""
+    global _course_fts_available
+    if _course_fts_available is None:
+        row = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'courses_fts'")
+        ).first()
+        _course_fts_available = row is not None
+    return _course_fts_available
+
+
+def search_courses(course_query, term):
+    """Filter a course query by title/description using the best index available"""
+    term = (term or '').strip()
+    if not term:
+        return course_query.order_by(Course.id)
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        # Full-text match for whole words, trigram-indexed ILIKE for partial titles
+        tsquery = db.func.plainto_tsquery('english', term)
+        document = db.literal_column(COURSE_SEARCH_DOCUMENT)
+        return course_query.filter(
+            db.or_(document.op('@@')(tsquery), Course.title.ilike(like_pattern(term), escape='\\'))
+        ).order_by(Course.id)
+
+    if dialect == 'sqlite' and course_fts_available():
+        # Quote every token and prefix-match it so user input can't inject FTS5 syntax
+        match = ' '.join('"{}"*'.format(token.replace('"', '""')) for token in term.split())
+        matching_ids = text('SELECT rowid FROM courses_fts WHERE courses_fts MATCH :match').bindparams(match=match)
+        return course_query.filter(Course.id.in_(matching_ids)).order_by(Course.id)
+
+    pattern = like_pattern(term)
+    return course_query.filter(
+        db.or_(Course.title.ilike(pattern, escape='\\'), Course.description.ilike(pattern, escape='\\'))
+    ).order_by(Course.id)
+
+
+def catalog_page(term, page):
+    """Return one page of the searchable catalog plus whether another page follows"""
+    page = max(page, 1)
+    courses = with_teacher_names(
+        search_courses(Course.query, term),
+        limit=CATALOG_PAGE_SIZE + 1,
+        offset=(page - 1) * CATALOG_PAGE_SIZE
+    )
+    # Fetching one extra row tells us about the next page without a COUNT over the catalog
+    has_next = len(courses) > CATALOG_PAGE_SIZE
+    return courses[:CATALOG_PAGE_SIZE], has_next
+
+
+def with_teacher_names(course_query, limit=None, offset=None):
+    """Attach teacher_name to each course using one outer join instead of a lookup per course"""
+    rows = (
+        course_query
+        .outerjoin(User, User.id == Course.teacher_id)
+        .add_columns(User.name)
+        .limit(limit)
+        .offset(offset)
+        .all()
+    )
+    courses = []
+    for course, teacher_name in rows:
+        course.teacher_name = teacher_name or 'Unknown'
+        courses.append(course)
+    return courses
+
+
 @app.route('/student/<int:id>')
 @role_required('student')
 def student_dashboard(id):
+    search_term = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
 
-    
-    all_courses = Course.query.all()
-    
-    for c in all_courses:
-        teacher = User.query.get(c.teacher_id) if c.teacher_id else None
-        c.teacher_name = teacher.name if teacher else 'Unknown'
+    all_courses, has_next = catalog_page(search_term, page)
 
-    
-    enrolled_courses = (
+    enrolled_courses = with_teacher_names(
         db.session.query(Course)
         .join(Enrollment, Course.id == Enrollment.course_id)
         .filter(Enrollment.student_id == id)
-        .all()
-        )
-
-    
-    for c in enrolled_courses:
-        teacher = User.query.get(c.teacher_id) if c.teacher_id else None
-        c.teacher_name = teacher.name if teacher else 'Unknown'
+    )
 
     enrolled_course_ids = [c.id for c in enrolled_courses]
 
@@ -890,10 +2260,34 @@ def student_dashboard(id):
         student_id=id,
         all_courses=all_courses,
         enrolled_courses=enrolled_courses,
-        enrolled_course_ids=enrolled_course_ids
+        enrolled_course_ids=enrolled_course_ids,
+        search_term=search_term,
+        page=max(page, 1),
+        has_next=has_next
     )
 
 
+@app.route('/api/courses')
+def api_courses():
+    page = max(request.args.get('page', 1, type=int), 1)
+    courses, has_next = catalog_page(request.args.get('q', ''), page)
+
+    return jsonify({
+        'page': page,
+        'has_next': has_next,
+        'courses': [
+            {
+                'course_id': c.id,
+                'title': c.title,
+                'description': c.description,
+                'teacher_name': c.teacher_name,
+                'price': float(c.price or 0),
+                'currency': c.currency
+            } for c in courses
+        ]
+    })
+
+
 @app.route('/enroll', methods=['POST'])
 @role_required('student')
 def enroll():
@@ -948,6 +2342,8 @@ def create_quiz(course_id):
             created_by=session.get('id')
         )
         db.session.add(quiz)
+        db.session.flush()
+        db.session.add(QuizSummary(quiz_id=quiz.id))
         db.session.commit()
         
         if request.form.get('redirect_to') == 'manage_course_quizzes':
@@ -979,6 +2375,191 @@ def manage_quiz(quiz_id):
     return redirect(url_for('manage_course_quizzes', course_id=quiz.course_id))
 
 
+class LRUCache:
+    """Thread-safe map that evicts the least recently used entry once it holds `capacity` items"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+# Immutable, already-parsed copy of a Question that can be shared across requests and threads
+CachedQuestion = namedtuple('CachedQuestion', 'id question_text question_type options correct_answer points order')
+
+QUIZ_CACHE_SIZE = int(os.getenv('QUIZ_CACHE_SIZE', 256))
+
+# Both map quiz_id -> (version, value); a version mismatch means another worker changed the quiz
+answer_key_cache = LRUCache(QUIZ_CACHE_SIZE)
+quiz_question_cache = LRUCache(QUIZ_CACHE_SIZE)
+
+
+def quiz_answer_key(quiz):
+    """Answer key for the quiz's current version, built from one narrow query on a cache miss"""
+    cached = answer_key_cache.get(quiz.id)
+    if cached and cached[0] == quiz.version:
+        return cached[1]
+
+    key = build_answer_key(
+        db.session.query(Question.id, Question.correct_answer, Question.points)
+        .filter(Question.quiz_id == quiz.id)
+        .order_by(Question.order, Question.id)
+        .all()
+    )
+    answer_key_cache.set(quiz.id, (quiz.version, key))
+    return key
+
+
+def quiz_questions(quiz):
+    """Questions of the quiz's current version in order, with options already parsed from JSON"""
+    cached = quiz_question_cache.get(quiz.id)
+    if cached and cached[0] == quiz.version:
+        return cached[1]
+
+    questions = tuple(
+        CachedQuestion(
+            id=q.id,
+            question_text=q.question_text,
+            question_type=q.question_type,
+            options=tuple(json.loads(q.options) if q.options else ()),
+            correct_answer=q.correct_answer,
+            points=q.points,
+            order=q.order
+        )
+        for q in Question.query.filter_by(quiz_id=quiz.id).order_by(Question.order, Question.id)
+    )
+    quiz_question_cache.set(quiz.id, (quiz.version, questions))
+    return questions
+
+
+def drop_cached_quiz(quiz_id):
+    answer_key_cache.pop(quiz_id)
+    quiz_question_cache.pop(quiz_id)
+
+
+def invalidate_quiz_caches(quiz):
+    """Bump the quiz version so every worker drops its cached copies, then drop ours"""
+    quiz.version = Quiz.version + 1
+    drop_cached_quiz(quiz.id)
+
+
+REGRADE_CHUNK_SIZE = 5000
+
+
+def iter_graded_attempts(quiz, key, chunk_size=REGRADE_CHUNK_SIZE):
+    """Stream a quiz's submitted attempts in id order, yielding (ids, answers, scores) per chunk"""
+    last_id = 0
+    while True:
+        rows = (
+            db.session.query(QuizAttempt.id, QuizAttempt.answers)
+            .filter(
+                QuizAttempt.quiz_id == quiz.id,
+                QuizAttempt.submitted_at.isnot(None),
+                QuizAttempt.id > last_id
+            )
+            .order_by(QuizAttempt.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        submissions = [json.loads(answers) if answers else {} for _, answers in rows]
+        yield [attempt_id for attempt_id, _ in rows], submissions, grade_batch(key, submissions)
+
+
+def regrade_quiz(quiz, chunk_size=REGRADE_CHUNK_SIZE):
+    """Re-score every submitted attempt against the current answer key with bulk UPDATEs.
+
+    Returns (attempts regraded, per-question statistics).
+    """
+    # The correct answers may have been edited outside add_question, so never trust a cached key here
+    invalidate_quiz_caches(quiz)
+    db.session.commit()
+    key = quiz_answer_key(quiz)
+    stats = ItemStatistics(key)
+
+    regraded = 0
+    for attempt_ids, submissions, scores in iter_graded_attempts(quiz, key, chunk_size):
+        updates = []
+        for attempt_id, score in zip(attempt_ids, scores):
+            percentage = grade_percentage(score, key.max_score)
+            updates.append({
+                'id': attempt_id,
+                'score': score,
+                'max_score': key.max_score,
+                'percentage': percentage,
+                'passed': percentage >= quiz.passing_score,
+            })
+        db.session.execute(update(QuizAttempt), updates)
+        db.session.commit()
+        stats.add_batch(submissions, scores)
+        regraded += len(updates)
+    rebuild_quiz_summaries([quiz.id])
+    db.session.commit()
+    return regraded, stats.results()
+
+
+def quiz_item_statistics(quiz, chunk_size=REGRADE_CHUNK_SIZE):
+    """Per-question difficulty/discrimination from the stored answers, without writing anything"""
+    key = quiz_answer_key(quiz)
+    stats = ItemStatistics(key)
+    for _, submissions, scores in iter_graded_attempts(quiz, key, chunk_size):
+        stats.add_batch(submissions, scores)
+    return stats.count, stats.results()
+
+
+def can_manage_quiz(quiz):
+    """Quiz authors and admins; routes using this list both roles in role_required to match"""
+    return session.get('role') == 'admin' or quiz.created_by == session.get('id')
+
+
+@app.route('/quiz/<int:quiz_id>/regrade', methods=['POST'])
+@role_required('teacher', 'admin')
+def regrade_quiz_attempts(quiz_id):
+    quiz = Quiz.query.get_or_404(quiz_id)
+    if not can_manage_quiz(quiz):
+        flash('You do not have permission to regrade this quiz.')
+        return redirect(url_for('teacher_dashboard', id=session.get('id')))
+
+    regraded, _ = regrade_quiz(quiz)
+    flash(f'Regraded {regraded} attempts for "{quiz.title}".')
+    return redirect(url_for('teacher_quiz_tracker', id=session.get('id')))
+
+
+@app.route('/quiz/<int:quiz_id>/analytics', methods=['GET'])
+@role_required('teacher', 'admin')
+def quiz_analytics(quiz_id):
+    quiz = Quiz.query.get_or_404(quiz_id)
+    if not can_manage_quiz(quiz):
+        return jsonify({'message': 'Forbidden'}), 403
+
+    attempts, questions = quiz_item_statistics(quiz)
+    return jsonify({
+        'quiz_id': quiz.id,
+        'attempts': attempts,
+        'questions': questions
+    })
+
+
 @app.route('/quiz/<int:quiz_id>/question/add', methods=['POST'])
 @role_required('teacher')
 def add_question(quiz_id):
@@ -995,6 +2576,7 @@ def add_question(quiz_id):
         order=Question.query.filter_by(quiz_id=quiz_id).count() + 1
     )
     db.session.add(question)
+    invalidate_quiz_caches(quiz)
     db.session.commit()
     
     flash('Question added successfully!')
@@ -1016,62 +2598,307 @@ def list_quizzes(course_id):
         return redirect(url_for('view_course', course_id=course_id))
         
     quizzes = Quiz.query.filter_by(course_id=course_id).all()
-    attempts = {a.quiz_id: a for a in QuizAttempt.query.filter_by(student_id=session.get('id')).all()}
+    attempts = best_and_latest_attempts(session.get('id'), course_id)
     
     return render_template('quiz-list.html', course=course, quizzes=quizzes, attempts=attempts)
 
 
+def best_and_latest_attempts(student_id, course_id):
+    """Map quiz id to {'best', 'latest', 'count'} for one student's submitted attempts in one course.
+
+    A single windowed query over the (student_id, quiz_id, started_at) index ranks each quiz's attempts
+    twice and keeps only the two rows the quiz list shows.
+    """
+    ranked = db.session.query(
+        QuizAttempt.id.label('attempt_id'),
+        db.func.row_number().over(
+            partition_by=QuizAttempt.quiz_id,
+            order_by=(QuizAttempt.percentage.desc(), QuizAttempt.submitted_at.desc())
+        ).label('best_rank'),
+        db.func.row_number().over(
+            partition_by=QuizAttempt.quiz_id,
+            order_by=(QuizAttempt.submitted_at.desc(), QuizAttempt.id.desc())
+        ).label('latest_rank'),
+        db.func.count(QuizAttempt.id).over(partition_by=QuizAttempt.quiz_id).label('attempt_count')
+    ).join(
+        Quiz, Quiz.id == QuizAttempt.quiz_id
+    ).filter(
+        QuizAttempt.student_id == student_id,
+        Quiz.course_id == course_id,
+        QuizAttempt.submitted_at.isnot(None)
+    ).subquery()
+
+    rows = (
+        db.session.query(QuizAttempt, ranked.c.best_rank, ranked.c.latest_rank, ranked.c.attempt_count)
+        .join(ranked, ranked.c.attempt_id == QuizAttempt.id)
+        .filter(db.or_(ranked.c.best_rank == 1, ranked.c.latest_rank == 1))
+        .all()
+    )
+    attempts = {}
+    for attempt, best_rank, latest_rank, count in rows:
+        entry = attempts.setdefault(attempt.quiz_id, {'count': count})
+        if best_rank == 1:
+            entry['best'] = attempt
+        if latest_rank == 1:
+            entry['latest'] = attempt
+    return attempts
+
+
+TRACKER_ATTEMPTS_PAGE_SIZE = 20
+TRACKER_UNION_CHUNK_SIZE = 200  # Quizzes per UNION ALL statement
+
+
+def upsert(model):
+    """INSERT for `model` that supports on_conflict_do_update on Postgres and SQLite"""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql_insert(model)
+    return sqlite_insert(model)
+
+
+def quiz_summary_rows(quiz_ids):
+    """QuizSummary values for these quizzes computed from their submitted attempts with one GROUP BY"""
+    rows = (
+        db.session.query(
+            QuizAttempt.quiz_id,
+            db.func.count(QuizAttempt.id),
+            db.func.sum(db.case((QuizAttempt.passed.is_(True), 1), else_=0)),
+            db.func.coalesce(db.func.sum(QuizAttempt.percentage), 0),
+            db.func.max(QuizAttempt.submitted_at)
+        )
+        .filter(QuizAttempt.quiz_id.in_(quiz_ids), QuizAttempt.submitted_at.isnot(None))
+        .group_by(QuizAttempt.quiz_id)
+        .all()
+    )
+    totals = {row[0]: row[1:] for row in rows}
+    return [
+        dict(zip(
+            ('quiz_id', 'attempt_count', 'passed_count', 'percentage_total', 'last_submitted_at'),
+            (quiz_id,) + tuple(totals.get(quiz_id, (0, 0, 0, None)))
+        ))
+        for quiz_id in quiz_ids
+    ]
+
+
+def rebuild_quiz_summaries(quiz_ids):
+    """Recompute the QuizSummary rows for these quizzes; an upsert, so concurrent rebuilds can't collide"""
+    if not quiz_ids:
+        return
+    statement = upsert(QuizSummary)
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[QuizSummary.quiz_id],
+            set_={
+                column: statement.excluded[column]
+                for column in ('attempt_count', 'passed_count', 'percentage_total', 'last_submitted_at')
+            }
+        ),
+        quiz_summary_rows(quiz_ids)
+    )
+
+
+def record_quiz_submission(attempt):
+    """Fold one newly submitted attempt into its quiz's summary row"""
+    increment = {
+        'attempt_count': QuizSummary.attempt_count + 1,
+        'passed_count': QuizSummary.passed_count + (1 if attempt.passed else 0),
+        'percentage_total': QuizSummary.percentage_total + attempt.percentage,
+        'last_submitted_at': attempt.submitted_at,
+    }
+    result = db.session.execute(
+        update(QuizSummary).where(QuizSummary.quiz_id == attempt.quiz_id).values(**increment)
+    )
+    if result.rowcount == 0:
+        # Quizzes created before summaries existed get theirs built from scratch, this attempt included.
+        # If another first submission creates the row meanwhile, it can't have counted this attempt
+        # (not committed yet), so the conflict branch adds it on top.
+        db.session.flush()
+        db.session.execute(
+            upsert(QuizSummary)
+            .values(quiz_summary_rows([attempt.quiz_id]))
+            .on_conflict_do_update(index_elements=[QuizSummary.quiz_id], set_=increment)
+        )
+
+
+def quiz_rollup(summary):
+    count = summary.attempt_count if summary else 0
+    return {
+        'attempt_count': count,
+        'mean_percentage': float(summary.percentage_total) / count if count else None,
+        'pass_rate': summary.passed_count / count * 100 if count else None,
+        'last_submitted_at': summary.last_submitted_at if summary else None,
+    }
+
+
+def recent_attempts_by_quiz(quiz_ids, limit, offsets=None):
+    """Map each quiz id to a page of its submitted attempts (newest first) as (attempt, student) pairs.
+
+    Each quiz gets its own LIMITed branch over the (quiz_id, submitted_at, id) index, glued together
+    with UNION ALL, so the cost follows the page size rather than how many attempts a quiz has.
+    Quizzes go TRACKER_UNION_CHUNK_SIZE at a time to stay under SQLite's 500-term compound SELECT
+    limit. `offsets` moves individual quizzes past their first page. Each list holds up to
+    `limit` + 1 rows so callers can tell whether another page exists.
+    """
+    attempts = {quiz_id: [] for quiz_id in quiz_ids}
+    offsets = offsets or {}
+
+    newest_first = (QuizAttempt.submitted_at.desc(), QuizAttempt.id.desc())
+    for start in range(0, len(quiz_ids), TRACKER_UNION_CHUNK_SIZE):
+        branches = []
+        for quiz_id in quiz_ids[start:start + TRACKER_UNION_CHUNK_SIZE]:
+            page = (
+                db.select(QuizAttempt.id)
+                .where(QuizAttempt.quiz_id == quiz_id, QuizAttempt.submitted_at.isnot(None))
+                .order_by(*newest_first)
+                .limit(limit + 1)
+                .offset(offsets.get(quiz_id, 0))
+                .subquery()
+            )
+            # Wrapped so SQLite accepts a LIMIT inside each UNION ALL branch
+            branches.append(db.select(page.c.id))
+        page_ids = db.union_all(*branches) if len(branches) > 1 else branches[0]
+
+        rows = (
+            db.session.query(QuizAttempt, User)
+            .join(User, QuizAttempt.student_id == User.id)
+            .filter(QuizAttempt.id.in_(page_ids))
+            .order_by(QuizAttempt.quiz_id, *newest_first)
+            .all()
+        )
+        for attempt, student in rows:
+            attempts[attempt.quiz_id].append((attempt, student))
+    return attempts
+
+
+# Taking a quiz hands out a signed token instead of inserting a row; the attempt is written on submit
+ATTEMPT_TOKEN_MAX_AGE = 24 * 3600
+ABANDONED_ATTEMPT_AGE = timedelta(hours=24)
+attempt_serializer = URLSafeTimedSerializer(app.secret_key, salt='quiz-attempt')
+
+
+def grade_attempt(quiz, attempt, form):
+    key = quiz_answer_key(quiz)
+    user_answers = collect_answers(key, form)
+    score = score_answers(key, user_answers)
+    percentage = grade_percentage(score, key.max_score)
+    passed = percentage >= quiz.passing_score
+    
+    attempt.answers = json.dumps(user_answers)
+    attempt.score = score
+    attempt.max_score = key.max_score
+    attempt.percentage = percentage
+    attempt.passed = passed
+    attempt.submitted_at = datetime.utcnow()
+    record_quiz_submission(attempt)
+
+
+def sweep_abandoned_attempts(older_than=ABANDONED_ATTEMPT_AGE, chunk_size=PURGE_CHUNK_SIZE, max_chunks=None):
+    """Delete never-submitted attempts older than `older_than` in small chunks; returns how many went"""
+    cutoff = datetime.utcnow() - older_than
+    return delete_in_chunks(
+        QuizAttempt,
+        db.and_(QuizAttempt.submitted_at.is_(None), QuizAttempt.started_at < cutoff),
+        chunk_size,
+        max_chunks
+    )
+
+
+# Vercel's time limit caps one run; anything left is swept on the next one
+CRON_SWEEP_MAX_CHUNKS = int(os.getenv('CRON_SWEEP_MAX_CHUNKS', 20))
+
+
+@app.route('/cron/sweep', methods=['GET', 'POST'])
+@cron_required
+def cron_sweep():
+    return jsonify({
+        'abandoned_attempts': sweep_abandoned_attempts(max_chunks=CRON_SWEEP_MAX_CHUNKS),
+        'expired_payments': expire_stale_payments(max_chunks=CRON_SWEEP_MAX_CHUNKS),
+    })
+
+
 @app.route('/quiz/<int:quiz_id>/take', methods=['GET'])
 @role_required('student')
 def take_quiz(quiz_id):
     quiz = Quiz.query.get_or_404(quiz_id)
+    student_id = session.get('id')
     
-    enrolled = Enrollment.query.filter_by(student_id=session.get('id'), course_id=quiz.course_id).first()
+    enrolled = Enrollment.query.filter_by(student_id=student_id, course_id=quiz.course_id).first()
     if not enrolled:
         flash('You must be enrolled to take this quiz.')
         return redirect(url_for('home'))
         
-    questions = Question.query.filter_by(quiz_id=quiz_id).order_by(Question.order).all()
-    
+    questions = quiz_questions(quiz)
     
-    attempt = QuizAttempt(
-        quiz_id=quiz_id,
-        student_id=session.get('id')
+    # Reuse an attempt left open by an earlier page view rather than starting another one
+    open_attempt = (
+        QuizAttempt.query
+        .filter_by(quiz_id=quiz_id, student_id=student_id, submitted_at=None)
+        .order_by(QuizAttempt.id.desc())
+        .first()
     )
-    db.session.add(attempt)
-    db.session.commit()
+    attempt_token = attempt_serializer.dumps({
+        'quiz_id': quiz_id,
+        'student_id': student_id,
+        'attempt_id': open_attempt.id if open_attempt else None,
+        'started_at': (open_attempt.started_at if open_attempt else datetime.utcnow()).isoformat()
+    })
     
-    return render_template('quiz-take.html', quiz=quiz, questions=questions, attempt_id=attempt.id)
+    return render_template('quiz-take.html', quiz=quiz, questions=questions, attempt_token=attempt_token)
 
 
-@app.route('/quiz/<int:quiz_id>/submit/<int:attempt_id>', methods=['POST'])
+@app.route('/quiz/<int:quiz_id>/submit', methods=['POST'])
 @role_required('student')
-def submit_quiz(quiz_id, attempt_id):
+def submit_quiz(quiz_id):
     quiz = Quiz.query.get_or_404(quiz_id)
-    attempt = QuizAttempt.query.get_or_404(attempt_id)
+    student_id = session.get('id')
     
-    questions = Question.query.filter_by(quiz_id=quiz_id).all()
-    user_answers = {}
-    score = 0
-    total_points = 0
+    try:
+        token = attempt_serializer.loads(request.form.get('attempt_token', ''), max_age=ATTEMPT_TOKEN_MAX_AGE)
+    except BadSignature:
+        flash('Your quiz session has expired. Please start the quiz again.')
+        return redirect(url_for('list_quizzes', course_id=quiz.course_id))
     
-    for q in questions:
-        total_points += q.points
-        answer = request.form.get(f'question_{q.id}')
-        user_answers[str(q.id)] = answer
-        if answer == q.correct_answer:
-            score += q.points
-            
-    percentage = (score / total_points * 100) if total_points > 0 else 0
-    passed = percentage >= quiz.passing_score
+    if token['quiz_id'] != quiz_id or token['student_id'] != student_id:
+        flash('Unauthorized.')
+        return redirect(url_for('home'))
     
-    attempt.answers = json.dumps(user_answers)
-    attempt.score = score
-    attempt.max_score = total_points
-    attempt.percentage = percentage
-    attempt.passed = passed
-    attempt.submitted_at = datetime.utcnow()
+    started_at = datetime.fromisoformat(token['started_at'])
+    if token['attempt_id']:
+        attempt = QuizAttempt.query.filter_by(id=token['attempt_id'], student_id=student_id).first()
+    else:
+        # The start time identifies the quiz session, so a double-submit finds the row the first one wrote
+        attempt = QuizAttempt.query.filter_by(quiz_id=quiz_id, student_id=student_id, started_at=started_at).first()
+    
+    if not attempt:
+        attempt = QuizAttempt(quiz_id=quiz_id, student_id=student_id, started_at=started_at)
+        db.session.add(attempt)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # A concurrent submit of the same session inserted first; carry on with its row
+            db.session.rollback()
+            attempt = QuizAttempt.query.filter_by(quiz_id=quiz_id, student_id=student_id, started_at=started_at).one()
+    if attempt.submitted_at:
+        return redirect(url_for('quiz_results', attempt_id=attempt.id))
+    
+    grade_attempt(quiz, attempt, request.form)
+    db.session.commit()
+    
+    return redirect(url_for('quiz_results', attempt_id=attempt.id))
+
+
+@app.route('/quiz/<int:quiz_id>/submit/<int:attempt_id>', methods=['POST'])
+@role_required('student')
+def submit_quiz_attempt(quiz_id, attempt_id):
+    # Kept for quiz pages rendered before attempts were created lazily
+    quiz = Quiz.query.get_or_404(quiz_id)
+    attempt = QuizAttempt.query.get_or_404(attempt_id)
+    if attempt.student_id != session.get('id') or attempt.quiz_id != quiz_id:
+        flash('Unauthorized.')
+        return redirect(url_for('home'))
+    if attempt.submitted_at:
+        return redirect(url_for('quiz_results', attempt_id=attempt.id))
     
+    grade_attempt(quiz, attempt, request.form)
     db.session.commit()
     
     return redirect(url_for('quiz_results', attempt_id=attempt.id))
@@ -1086,7 +2913,7 @@ def quiz_results(attempt_id):
         return redirect(url_for('home'))
         
     quiz = Quiz.query.get(attempt.quiz_id)
-    questions = Question.query.filter_by(quiz_id=quiz.id).all()
+    questions = quiz_questions(quiz)
     answers = json.loads(attempt.answers) if attempt.answers else {}
     
     return render_template('quiz-results.html', attempt=attempt, quiz=quiz, questions=questions, answers=answers)
@@ -1105,7 +2932,7 @@ def view_attempt_detail(attempt_id):
     quiz = Quiz.query.get(attempt.quiz_id)
     student = User.query.get(attempt.student_id)
     
-    questions = Question.query.filter_by(quiz_id=quiz.id).order_by(Question.order).all()
+    questions = quiz_questions(quiz)
     student_answers = json.loads(attempt.answers) if attempt.answers else {}
     
     return render_template(
@@ -1123,27 +2950,44 @@ def teacher_quiz_tracker(id):
     if id != session.get('id'):
         flash('Unauthorized')
         return redirect(url_for('home'))
-    quizzes = Quiz.query.filter_by(created_by=id).all()
-    
+    # Summaries ride along with the quizzes, so the page never scans every attempt
+    quizzes = (
+        db.session.query(Quiz, QuizSummary)
+        .outerjoin(QuizSummary, QuizSummary.quiz_id == Quiz.id)
+        .filter(Quiz.created_by == id)
+        .order_by(Quiz.id)
+        .all()
+    )
+    missing = [quiz.id for quiz, summary in quizzes if summary is None]
+    if missing:
+        rebuild_quiz_summaries(missing)
+        db.session.commit()
+        summaries = {summary.quiz_id: summary for summary in QuizSummary.query.filter(QuizSummary.quiz_id.in_(missing))}
+        quizzes = [(quiz, summary or summaries.get(quiz.id)) for quiz, summary in quizzes]
+
+    # ?quiz=<id>&page=<n> pages through one quiz's attempts; the others stay on their first page
+    focus_quiz = request.args.get('quiz', type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
+    offsets = {focus_quiz: (page - 1) * TRACKER_ATTEMPTS_PAGE_SIZE} if focus_quiz and page > 1 else None
+    attempts = recent_attempts_by_quiz([quiz.id for quiz, _ in quizzes], TRACKER_ATTEMPTS_PAGE_SIZE, offsets)
+
     quiz_data = []
-    for quiz in quizzes:
-        
-        attempts = db.session.query(QuizAttempt, User).join(
-            User, QuizAttempt.student_id == User.id
-        ).filter(
-            QuizAttempt.quiz_id == quiz.id
-        ).order_by(QuizAttempt.submitted_at.desc()).all()
-        
-        quiz_data.append({
-            'quiz': quiz,
-            'attempts': attempts,
-            'attempt_count': len(attempts)
-        })
+    for quiz, summary in quizzes:
+        quiz_page = page if quiz.id == focus_quiz else 1
+        quiz_attempts = attempts[quiz.id]
+        quiz_data.append(dict(
+            quiz_rollup(summary),
+            quiz=quiz,
+            attempts=quiz_attempts[:TRACKER_ATTEMPTS_PAGE_SIZE],
+            page=quiz_page,
+            has_next=len(quiz_attempts) > TRACKER_ATTEMPTS_PAGE_SIZE
+        ))
         
     return render_template(
         'teacher-quiz-tracker.html',
         teacher_id=id,
-        quiz_data=quiz_data
+        quiz_data=quiz_data,
+        focus_quiz=focus_quiz
     )
 
 
@@ -1158,15 +3002,10 @@ def delete_quiz(quiz_id):
         return redirect(url_for('teacher_dashboard', id=session.get('id')))
     
     try:
-        # 1. Delete associated questions
-        Question.query.filter_by(quiz_id=quiz_id).delete()
-        
-        # 2. Delete associated quiz attempts
-        QuizAttempt.query.filter_by(quiz_id=quiz_id).delete()
-        
-        # 3. Delete the quiz itself
-        db.session.delete(quiz)
+        # Questions, attempts and the rollup go with the quiz
+        delete_quizzes([quiz_id])
         db.session.commit()
+        drop_cached_quiz(quiz_id)
         
         flash('Quiz and all associated data deleted successfully!')
     except Exception as e:
@@ -1182,12 +3021,13 @@ def delete_quiz(quiz_id):
 @app.route('/admin/delete-course/<int:course_id>', methods=['POST'])
 @role_required('admin')
 def admin_delete_course(course_id):
-    Enrollment.query.filter_by(course_id=course_id).delete()
     course = Course.query.get(course_id)
     if course:
         title = course.title
-        db.session.delete(course)
+        deleted_quizzes = delete_courses([course_id])
         db.session.commit()
+        for quiz_id in deleted_quizzes:
+            drop_cached_quiz(quiz_id)
         flash(f'Course "{title}" deleted successfully!')
 
     return redirect(url_for('admin_dashboard'))
@@ -1206,6 +3046,7 @@ def edit_course_materials(course_id):
     return render_template(
         'edit-course.html',
         course=course,
+        materials=course_materials(course_id),
         teacher_id=session.get('id')
     )
 
@@ -1222,57 +3063,45 @@ def update_course_materials(course_id):
         
         course.content = request.form.get('content', '')
         
-        # Get existing materials
-        materials_list = []
-        if course.materials:
-            try:
-                materials_list = json.loads(course.materials)
-            except:
-                materials_list = []
+        # Save content and links first so they don't wait on the uploads
+        db.session.add(course)
+        db.session.commit()
         
-        # 1. Handle YouTube Link
+        # 1. Handle YouTube Link (new materials are appended after the current last position)
         youtube_link = request.form.get('youtube_link', '').strip()
         youtube_title = request.form.get('youtube_title', '').strip() or 'Video Lecture (YouTube)'
         if youtube_link:
-            materials_list.append({
-                'name': youtube_title,
-                'path': youtube_link,
-                'type': 'youtube'
-            })
+            add_material(course_id, name=youtube_title, path=youtube_link, type='youtube')
         
-        # 2. Process uploaded files using Cloudinary
-        if 'materials' in request.files:
-            files = request.files.getlist('materials')
-            for file in files:
-                if file and file.filename and allowed_file(file.filename):
-                    try:
-                        # Upload to Cloudinary using 'auto' for better delivery
-                        result = cloudinary.uploader.upload(
-                            file,
-                            folder=f"course_materials/{course_id}",
-                            resource_type="auto",
-                            use_filename=True,
-                            unique_filename=True
-                        )
-                        
-                        # Sanitize URL to remove any backslashes
-                        secure_url = result['secure_url'].replace('\\', '/')
-                        
-                        materials_list.append({
-                            'name': file.filename,
-                            'path': secure_url,
-                            'type': 'file',
-                            'cloudinary_id': result['public_id']
-                        })
-                    except Exception as upload_error:
-                        import traceback
-                        print(f"UPLOAD ERROR for {file.filename}:")
-                        print(traceback.format_exc())
-                        flash(f'Error uploading {file.filename}: {str(upload_error)}', 'danger')
+        # 2. Upload files to Cloudinary concurrently, saving each material as soon as its upload finishes
+        files = [
+            file for file in request.files.getlist('materials')
+            if file and file.filename and allowed_file(file.filename)
+        ]
+        uploader = app.config.get('MATERIAL_UPLOADER') or cloudinary.uploader.upload
+        # Positions are reserved in pick order up front, so saving in completion order keeps the list in pick order
+        first_position = next_material_position(course_id)
+        uploads = {
+            upload_executor.submit(upload_material_file, uploader, file, course_id): (file.filename, first_position + i)
+            for i, file in enumerate(files)
+        }
+        for future in as_completed(uploads):
+            filename, position = uploads[future]
+            try:
+                result = future.result()
+            except Exception as upload_error:
+                import traceback
+                print(f"UPLOAD ERROR for {filename}:")
+                print(traceback.format_exc())
+                flash(f'Error uploading {filename}: {str(upload_error)}', 'danger')
+                continue
+            
+            # Sanitize URL to remove any backslashes
+            secure_url = result['secure_url'].replace('\\', '/')
+            
+            add_material(course_id, position, name=filename, path=secure_url, type='file',
+                         cloudinary_id=result['public_id'])
         
-        course.materials = json.dumps(materials_list)
-        db.session.add(course)
-        db.session.commit()
         flash('Course materials updated successfully!', 'success')
         return redirect(url_for('edit_course_materials', course_id=course_id))
     except Exception as e:
@@ -1305,13 +3134,7 @@ def view_course(course_id):
     # 2. Get the course details from the database
     course = Course.query.get_or_404(course_id)
     
-    # Parse materials JSON
-    materials = []
-    if course.materials:
-        try:
-            materials = json.loads(course.materials)
-        except:
-            materials = []
+    materials = course_materials(course_id)
     
     # 3. Show a new page called course_detail.html
     return render_template('course-view.html', 
@@ -1331,10 +3154,7 @@ def logout():
 def api_login():
     data = request.json
 
-    user = User.query.filter_by(
-        email=data['email'],
-        password=data['password']
-    ).first()
+    user = authenticate(data['email'], data['password'])
 
     if not user:
         return jsonify({'message': 'Invalid login'}), 401
@@ -1363,13 +3183,26 @@ def api_student_courses(id):
 @app.route('/api/enroll', methods=['POST'])
 def api_enroll():
     data = request.json
+    student_id, course_id = data['student_id'], data['course_id']
+
+    if not db.session.get(Course, course_id):
+        return jsonify({'message': 'Course not found'}), 404
+    if not db.session.get(User, student_id):
+        return jsonify({'message': 'Student not found'}), 404
 
     enrollment = Enrollment(
-        student_id=data['student_id'],
-        course_id=data['course_id']
+        student_id=student_id,
+        course_id=course_id
     )
     db.session.add(enrollment)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        # Only the unique (student_id, course_id) index means a duplicate; anything else is a vanished row
+        if Enrollment.query.filter_by(student_id=student_id, course_id=course_id).first():
+            return jsonify({'message': 'Already enrolled'}), 409
+        return jsonify({'message': 'Student or course no longer exists'}), 404
 
     return jsonify({'message': 'Enrolled successfully'})
 
@@ -1390,32 +3223,322 @@ def api_create_course():
 
 @app.route('/api/teacher/<int:id>/dashboard')
 def api_teacher_dashboard(id):
+    limit = request.args.get('limit', API_STUDENTS_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), API_STUDENTS_MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor', type=int)
+    course_id = request.args.get('course_id', type=int)
+    # Each course pages independently, so a cursor only means something for the course it came from
+    if cursor is not None and course_id is None:
+        return jsonify({'error': 'cursor requires course_id; pass the course_id whose next_cursor this is'}), 400
+
+    courses_query = Course.query.filter_by(teacher_id=id)
+    if course_id is not None:
+        courses_query = courses_query.filter_by(id=course_id)
+    teacher_courses = courses_query.order_by(Course.id).all()
+
+    course_ids = [course.id for course in teacher_courses]
+    counts = student_counts_by_course(course_ids)
+    # Fetch one extra student per course to know whether another page exists
+    course_students = students_by_course(course_ids, limit=limit + 1, after_id=cursor)
 
-    teacher_courses = Course.query.filter_by(teacher_id=id).all()
     result = []
-
     for course in teacher_courses:
-        students = db.session.query(User).join(
-            Enrollment, User.id == Enrollment.student_id
-        ).filter(
-            Enrollment.course_id == course.id
-        ).all()
+        students = course_students[course.id]
+        has_more = len(students) > limit
+        students = students[:limit]
 
         result.append({
             'course_id': course.id,
             'title': course.title,
-            'student_count': len(students),
+            'student_count': counts.get(course.id, 0),
             'students': [
                 {
                     'id': s.id,
                     'name': s.name,
                     'email': s.email
                 } for s in students
-            ]
+            ],
+            'next_cursor': students[-1].id if has_more else None
         })
 
     return jsonify(result)
 
 
+# /api/v2: bearer-token auth, keyset cursors, field selection and bulk writes in one transaction per batch
+API_TOKEN_MAX_AGE = int(os.getenv('API_TOKEN_MAX_AGE', 12 * 3600))
+API_V2_PAGE_SIZE = 100
+API_V2_MAX_PAGE_SIZE = 1000
+API_V2_BULK_LIMIT = 1000
+api_token_serializer = URLSafeTimedSerializer(app.secret_key, salt='api-token')
+
+API_V2_COURSE_FIELDS = {
+    'id': Course.id,
+    'title': Course.title,
+    'description': Course.description,
+    'teacher_id': Course.teacher_id,
+    'price': Course.price,
+    'currency': Course.currency,
+}
+API_V2_STUDENT_FIELDS = {
+    'id': User.id,
+    'name': User.name,
+    'email': User.email,
+}
+
+
+def api_error(message, status):
+    return jsonify({'error': message}), status
+
+
+def api_token_fingerprint(user):
+    """Short digest of the stored password hash: a new password (or hash upgrade) revokes earlier tokens"""
+    return hashlib.sha256((user.password or '').encode()).hexdigest()[:16]
+
+
+def issue_api_token(user):
+    return api_token_serializer.dumps({'uid': user.id, 'role': user.role, 'pwd': api_token_fingerprint(user)})
+
+
+def api_token_required(*allowed_roles):
+    """Like role_required, for bearer tokens: sets g.api_user to {'id', 'role'}; admins pass every check
+
+    Each request re-reads the user row, so deleted, purge-queued or re-roled users and changed passwords
+    lose access immediately rather than when the token expires.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() != 'bearer' or not token:
+                return api_error('Missing bearer token', 401)
+            try:
+                claims = api_token_serializer.loads(token, max_age=API_TOKEN_MAX_AGE)
+            except BadSignature:
+                return api_error('Invalid or expired token', 401)
+            row = (
+                db.session.query(User.id, User.role, User.password, UserPurge.user_id.label('purge_id'))
+                .outerjoin(UserPurge, UserPurge.user_id == User.id)
+                .filter(User.id == claims.get('uid'))
+                .first()
+            )
+            if (row is None or row.purge_id is not None or row.role != claims.get('role')
+                    or api_token_fingerprint(row) != claims.get('pwd')):
+                return api_error('Invalid or expired token', 401)
+            g.api_user = {'id': row.id, 'role': row.role}
+            if row.role != 'admin' and allowed_roles and row.role not in allowed_roles:
+                return api_error('Forbidden', 403)
+            return f(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def api_page_args():
+    """(limit, cursor) from ?limit=&cursor=, with limit clamped to API_V2_MAX_PAGE_SIZE"""
+    limit = min(max(request.args.get('limit', API_V2_PAGE_SIZE, type=int), 1), API_V2_MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor', type=int)
+    return limit, cursor
+
+
+def api_fields(allowed):
+    """Columns for ?fields=a,b (all allowed fields by default); the id is always included for the cursor"""
+    requested = [name.strip() for name in request.args.get('fields', '').split(',') if name.strip()]
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        return None, f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}"
+    names = ['id'] + [name for name in requested if name != 'id'] if requested else list(allowed)
+    return names, None
+
+
+def api_page(query, id_column, allowed):
+    """Run one keyset page of `query` selecting only the requested fields"""
+    names, error = api_fields(allowed)
+    if error:
+        return api_error(error, 400)
+    limit, cursor = api_page_args()
+    if cursor is not None:
+        query = query.filter(id_column > cursor)
+    rows = query.with_entities(*[allowed[name] for name in names]).order_by(id_column).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        'data': [
+            {name: (float(value) if name == 'price' and value is not None else value)
+             for name, value in zip(names, row)}
+            for row in rows
+        ],
+        'next_cursor': rows[-1][0] if has_more else None
+    })
+
+
+@app.route('/api/v2/token', methods=['POST'])
+def api_v2_token():
+    data = request.get_json(silent=True) or {}
+    if not data.get('email') or not data.get('password'):
+        return api_error('email and password are required', 400)
+
+    user = authenticate(data['email'], data['password'])
+    if not user:
+        return api_error('Invalid login', 401)
+    if user.role == 'student' and not user.email_verified:
+        return api_error('Email not verified', 403)
+
+    return jsonify({
+        'token': issue_api_token(user),
+        'token_type': 'Bearer',
+        'expires_in': API_TOKEN_MAX_AGE,
+        'user_id': user.id,
+        'role': user.role
+    })
+
+
+@app.route('/api/v2/courses', methods=['GET'])
+@api_token_required()
+def api_v2_courses():
+    query = Course.query
+    teacher_id = request.args.get('teacher_id', type=int)
+    if teacher_id is not None:
+        query = query.filter(Course.teacher_id == teacher_id)
+    return api_page(query, Course.id, API_V2_COURSE_FIELDS)
+
+
+@app.route('/api/v2/students/<int:student_id>/courses', methods=['GET'])
+@api_token_required('student')
+def api_v2_student_courses(student_id):
+    if g.api_user['role'] != 'admin' and g.api_user['id'] != student_id:
+        return api_error('Forbidden', 403)
+    query = Course.query.join(Enrollment, Enrollment.course_id == Course.id).filter(Enrollment.student_id == student_id)
+    return api_page(query, Course.id, API_V2_COURSE_FIELDS)
+
+
+@app.route('/api/v2/courses/<int:course_id>/students', methods=['GET'])
+@api_token_required('teacher')
+def api_v2_course_students(course_id):
+    course = db.session.get(Course, course_id)
+    if not course:
+        return api_error('Course not found', 404)
+    if g.api_user['role'] != 'admin' and course.teacher_id != g.api_user['id']:
+        return api_error('Forbidden', 403)
+    query = User.query.join(Enrollment, Enrollment.student_id == User.id).filter(Enrollment.course_id == course_id)
+    return api_page(query, User.id, API_V2_STUDENT_FIELDS)
+
+
+def bulk_items(key):
+    """The list under `key` in the JSON body, or an error response when it is missing or too large"""
+    items = (request.get_json(silent=True) or {}).get(key)
+    if not isinstance(items, list) or not items:
+        return None, api_error(f'"{key}" must be a non-empty list', 400)
+    if len(items) > API_V2_BULK_LIMIT:
+        return None, api_error(f'At most {API_V2_BULK_LIMIT} {key} per request', 413)
+    return items, None
+
+
+@app.route('/api/v2/enrollments/bulk', methods=['POST'])
+@api_token_required('teacher', 'student')
+def api_v2_bulk_enroll():
+    """Enroll many (student_id, course_id) pairs with a handful of queries and one commit.
+
+    Teachers may enroll anyone into their own courses, students only themselves into free courses.
+    Pairs that are invalid or already enrolled are reported under "skipped" by their index.
+    """
+    items, error = bulk_items('enrollments')
+    if error:
+        return error
+
+    pairs, skipped = [], []
+    for index, item in enumerate(items):
+        try:
+            pairs.append((index, int(item['student_id']), int(item['course_id'])))
+        except (KeyError, TypeError, ValueError):
+            skipped.append({'index': index, 'reason': 'student_id and course_id must be integers'})
+
+    student_ids = {student_id for _, student_id, _ in pairs}
+    course_ids = {course_id for _, _, course_id in pairs}
+    students = {row.id for row in db.session.query(User.id).filter(User.id.in_(student_ids), User.role == 'student')}
+    courses = {
+        row.id: row for row in
+        db.session.query(Course.id, Course.teacher_id, Course.price).filter(Course.id.in_(course_ids))
+    }
+
+    user = g.api_user
+    allowed = []
+    for index, student_id, course_id in pairs:
+        course = courses.get(course_id)
+        if student_id not in students or course is None:
+            reason = 'unknown student' if student_id not in students else 'unknown course'
+        elif user['role'] == 'teacher' and course.teacher_id != user['id']:
+            reason = 'not your course'
+        elif user['role'] == 'student' and (student_id != user['id'] or (course.price or 0) > 0):
+            reason = 'students may only enroll themselves in free courses'
+        else:
+            allowed.append((index, student_id, course_id))
+            continue
+        skipped.append({'index': index, 'reason': reason})
+
+    # A concurrent enroll can land between the lookup and the insert; the unique index catches it and we retry once
+    for attempt in range(2):
+        existing = set(
+            db.session.query(Enrollment.student_id, Enrollment.course_id)
+            .filter(Enrollment.student_id.in_({s for _, s, _ in allowed}),
+                    Enrollment.course_id.in_({c for _, _, c in allowed}))
+            .all()
+        ) if allowed else set()
+        rows, seen, duplicates = [], set(), []
+        for index, student_id, course_id in allowed:
+            if (student_id, course_id) in existing or (student_id, course_id) in seen:
+                reason = 'already enrolled' if (student_id, course_id) in existing else 'duplicate in batch'
+                duplicates.append({'index': index, 'reason': reason})
+                continue
+            seen.add((student_id, course_id))
+            rows.append({'student_id': student_id, 'course_id': course_id})
+        try:
+            if rows:
+                db.session.execute(insert(Enrollment), rows)
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            if attempt:
+                return api_error('Enrollments changed concurrently; retry the batch', 409)
+
+    return jsonify({
+        'enrolled': len(rows),
+        'skipped': sorted(skipped + duplicates, key=lambda item: item['index'])
+    })
+
+
+@app.route('/api/v2/courses/bulk', methods=['POST'])
+@api_token_required('teacher')
+def api_v2_bulk_create_courses():
+    """Create many courses in one INSERT; teachers always own what they create, admins may assign teacher_id"""
+    items, error = bulk_items('courses')
+    if error:
+        return error
+
+    rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not str(item.get('title') or '').strip():
+            return api_error(f'courses[{index}]: title is required', 400)
+        try:
+            price = float(item.get('price') or 0)
+        except (TypeError, ValueError):
+            return api_error(f'courses[{index}]: price must be a number', 400)
+        rows.append({
+            'title': str(item['title']).strip()[:100],
+            'description': item.get('description'),
+            'price': price,
+            'currency': str(item.get('currency') or 'INR').upper()[:3],
+            'teacher_id': item.get('teacher_id') if g.api_user['role'] == 'admin' else g.api_user['id'],
+        })
+
+    teacher_ids = {row['teacher_id'] for row in rows if row['teacher_id'] is not None}
+    known = {row.id for row in db.session.query(User.id).filter(User.id.in_(teacher_ids), User.role == 'teacher')}
+    if teacher_ids - known:
+        return api_error(f'Unknown teacher ids: {sorted(teacher_ids - known)}', 400)
+
+    ids = db.session.scalars(insert(Course).returning(Course.id, sort_by_parameter_order=True), rows).all()
+    db.session.commit()
+    return jsonify({'created': len(ids), 'course_ids': ids}), 201
+
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,141 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Never seed benchmark data into the configured application database
+os.environ['DATABASE_URL'] = os.getenv(
+    'BENCHMARK_DATABASE_URL',
+    'sqlite:///' + os.path.join(tempfile.gettempdir(), 'course_benchmark.db')
+)
+
+from sqlalchemy import insert, text
+from app import (app, db, User, Course, Enrollment, Quiz, Question, QuizAttempt, Payment,
+                 with_teacher_names, students_by_course, best_and_latest_attempts)
+from migrate_enhanced import ensure_model_indexes
+
+
+def seed(scale):
+    users = 10000 * scale
+    teachers = users // 50
+    courses = 1000 * scale
+    enrollments_per_student = 10
+    questions_per_quiz = 10
+    attempts = 100000 * scale
+
+    print(f"Seeding {users} users, {courses} courses, ~{users * enrollments_per_student} enrollments, "
+          f"{courses * 2} quizzes, {attempts} attempts...")
+    rng = random.Random(42)
+
+    db.session.execute(insert(User), [
+        {'id': i, 'name': f'User {i}', 'email': f'user{i}@example.com', 'password': 'x',
+         'role': 'teacher' if i <= teachers else 'student', 'email_verified': True,
+         'verification_token': f'token-{i}'}
+        for i in range(1, users + 1)
+    ])
+    db.session.execute(insert(Course), [
+        {'id': i, 'title': f'Course {i}', 'description': 'Benchmark course', 'price': 0,
+         'teacher_id': rng.randint(1, teachers)}
+        for i in range(1, courses + 1)
+    ])
+    db.session.execute(insert(Enrollment), [
+        {'student_id': student_id, 'course_id': course_id}
+        for student_id in range(teachers + 1, users + 1)
+        for course_id in rng.sample(range(1, courses + 1), enrollments_per_student)
+    ])
+    db.session.execute(insert(Quiz), [
+        {'id': i, 'course_id': (i - 1) // 2 + 1, 'title': f'Quiz {i}', 'created_by': 1}
+        for i in range(1, courses * 2 + 1)
+    ])
+    db.session.execute(insert(Question), [
+        {'quiz_id': quiz_id, 'question_text': f'Q{n}', 'options': '["a", "b", "c", "d"]',
+         'correct_answer': 'a', 'points': 1, 'order': n}
+        for quiz_id in range(1, courses * 2 + 1)
+        for n in range(1, questions_per_quiz + 1)
+    ])
+    db.session.execute(insert(QuizAttempt), [
+        {'quiz_id': rng.randint(1, courses * 2), 'student_id': rng.randint(teachers + 1, users),
+         'score': 5, 'max_score': 10, 'percentage': rng.randint(0, 100), 'passed': False,
+         'started_at': datetime(2024, 1, 1) + timedelta(minutes=n, seconds=-30),
+         'submitted_at': datetime(2024, 1, 1) + timedelta(minutes=n)}
+        for n in range(attempts)
+    ])
+    db.session.execute(insert(Payment), [
+        {'student_id': rng.randint(teachers + 1, users), 'course_id': rng.randint(1, courses),
+         'amount': 100, 'order_id': f'cs_{i}', 'status': 'completed'}
+        for i in range(courses * 5)
+    ])
+    db.session.commit()
+    return users, teachers, courses
+
+
+def drop_model_indexes():
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            db.session.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+    db.session.commit()
+
+
+def time_queries(users, teachers, courses, repeats):
+    rng = random.Random(7)
+    workloads = {
+        'student dashboard (enrolled courses)': lambda: with_teacher_names(
+            db.session.query(Course)
+            .join(Enrollment, Course.id == Enrollment.course_id)
+            .filter(Enrollment.student_id == rng.randint(teachers + 1, users))
+        ),
+        'teacher dashboard (students by course)': lambda: students_by_course(
+            [c.id for c in Course.query.filter_by(teacher_id=rng.randint(1, teachers)).all()]
+        ),
+        'take quiz (questions in order)': lambda: Question.query.filter_by(
+            quiz_id=rng.randint(1, courses * 2)).order_by(Question.order).all(),
+        'quiz tracker (attempts per quiz)': lambda: QuizAttempt.query.filter_by(
+            quiz_id=rng.randint(1, courses * 2)).all(),
+        'quiz list (every attempt, unscoped)': lambda: QuizAttempt.query.filter_by(
+            student_id=rng.randint(teachers + 1, users)).all(),
+        'quiz list (best/latest per quiz)': lambda: best_and_latest_attempts(
+            rng.randint(teachers + 1, users), rng.randint(1, courses)),
+        'payment success (order id)': lambda: Payment.query.filter_by(
+            order_id=f'cs_{rng.randint(0, courses * 5 - 1)}').first(),
+        'verify email (token)': lambda: User.query.filter_by(
+            verification_token=f'token-{rng.randint(1, users)}').first(),
+    }
+
+    results = {}
+    for name, run in workloads.items():
+        start = time.perf_counter()
+        for _ in range(repeats):
+            run()
+            db.session.expunge_all()
+        results[name] = (time.perf_counter() - start) / repeats * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the hot lookup queries with and without indexes')
+    parser.add_argument('--scale', type=int, default=1, help='multiplier for the seeded row counts')
+    parser.add_argument('--repeats', type=int, default=50, help='executions per query')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        users, teachers, courses = seed(args.scale)
+
+        drop_model_indexes()
+        before = time_queries(users, teachers, courses, args.repeats)
+
+        ensure_model_indexes()
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text('ANALYZE'))
+        after = time_queries(users, teachers, courses, args.repeats)
+
+    print(f"\n{'query':<42}{'no index (ms)':>15}{'indexed (ms)':>15}{'speedup':>10}")
+    for name in before:
+        print(f"{name:<42}{before[name]:>15.3f}{after[name]:>15.3f}{before[name] / after[name]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Never seed benchmark data into the configured application database
+os.environ['DATABASE_URL'] = os.getenv(
+    'BENCHMARK_DATABASE_URL',
+    'sqlite:///' + os.path.join(tempfile.gettempdir(), 'login_benchmark.db')
+)
+os.environ.setdefault('SLOW_QUERY_MS', '10000')
+
+from sqlalchemy import insert
+from app import app, db, User, password_hasher, percentile
+from credentials import is_hashed
+
+PASSWORD = 'correct horse battery staple'
+
+
+def seed(users, legacy):
+    # Every row shares one hash: verifying costs the same, and seeding doesn't pay the hash cost per user
+    hashed = password_hasher.hash(PASSWORD)
+    db.session.execute(insert(User), [
+        {'id': i, 'name': f'User {i}', 'email': f'user{i}@example.com', 'role': 'student', 'email_verified': True,
+         'password': PASSWORD if i > users - legacy else hashed}
+        for i in range(1, users + 1)
+    ])
+    db.session.commit()
+
+
+def hash_cost_ms(samples=5):
+    started = time.perf_counter()
+    for _ in range(samples):
+        password_hasher.hash(PASSWORD)
+    return (time.perf_counter() - started) / samples * 1000
+
+
+def attempt(client, rng, users, endpoint):
+    """One login: mostly valid, some wrong passwords and unknown emails; returns (outcome, ms, status)"""
+    roll = rng.random()
+    if roll < 0.8:
+        outcome, email, password = 'valid', f'user{rng.randint(1, users)}@example.com', PASSWORD
+    elif roll < 0.9:
+        outcome, email, password = 'wrong password', f'user{rng.randint(1, users)}@example.com', 'nope'
+    else:
+        outcome, email, password = 'unknown email', f'nobody{rng.randint(1, users)}@example.com', PASSWORD
+
+    started = time.perf_counter()
+    if endpoint == 'api':
+        response = client.post('/api/login', json={'email': email, 'password': password})
+    else:
+        response = client.post('/login', data={'email': email, 'password': password})
+    return outcome, (time.perf_counter() - started) * 1000, response.status_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure login latency under concurrent load against a p99 budget')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--legacy', type=int, default=500, help='seeded users still holding plaintext passwords')
+    parser.add_argument('--requests', type=int, default=400, help='logins in total')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--endpoint', choices=['api', 'form'], default='api', help='/api/login or the /login form')
+    parser.add_argument('--budget-ms', type=float, default=250, help='p99 login latency target')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(args.users, args.legacy)
+        print(f"Hash method {password_hasher.method_tag}: {hash_cost_ms():.1f} ms per hash")
+
+    def worker(seed):
+        client, rng = app.test_client(), random.Random(seed)
+        return [attempt(client, rng, args.users, args.endpoint) for _ in range(args.requests // args.concurrency)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = [result for batch in pool.map(worker, range(args.concurrency)) for result in batch]
+    wall = time.perf_counter() - started
+
+    print(f"\n{'outcome':<18}{'logins':>8}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+    for outcome in ('valid', 'wrong password', 'unknown email', 'all'):
+        latency = sorted(ms for name, ms, _ in results if outcome in ('all', name))
+        if latency:
+            print(f"{outcome:<18}{len(latency):>8}{percentile(latency, 50):>10.1f}"
+                  f"{percentile(latency, 95):>10.1f}{percentile(latency, 99):>10.1f}")
+    errors = sum(1 for _, _, status in results if status >= 500)
+    print(f"\n{len(results) / wall:.1f} logins/s with {args.concurrency} threads, {errors} errors")
+
+    with app.app_context():
+        upgraded = sum(1 for (stored,) in db.session.query(User.password).filter(User.id > args.users - args.legacy)
+                       if is_hashed(stored))
+        print(f"{upgraded} of {args.legacy} plaintext passwords upgraded to hashes")
+
+    p99 = percentile(sorted(ms for _, ms, _ in results), 99)
+    if p99 > args.budget_ms:
+        raise SystemExit(f"p99 {p99:.1f} ms is over the {args.budget_ms:.0f} ms budget; "
+                         f"lower PASSWORD_HASH_METHOD's cost or add workers")
+    print(f"✓ p99 {p99:.1f} ms is within the {args.budget_ms:.0f} ms budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+import argparse
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Never seed benchmark data into the configured application database
+os.environ['DATABASE_URL'] = os.getenv(
+    'BENCHMARK_DATABASE_URL',
+    'sqlite:///' + os.path.join(tempfile.gettempdir(), 'route_benchmark.db')
+)
+# Keep side work out of the timings and the slow-query log out of the report
+os.environ.setdefault('OUTBOX_BACKGROUND_DELIVERY', '0')
+os.environ.setdefault('SLOW_QUERY_MS', '10000')
+
+from sqlalchemy import event, insert, text
+from sqlalchemy.engine import Engine
+from app import (app, db, User, Course, Enrollment, Quiz, Question, QuizAttempt, Payment, percentile,
+                 rebuild_quiz_summaries, rebuild_revenue_rollups)
+from migrate_enhanced import ensure_model_indexes
+
+# Row counts at --scale 1
+VOLUMES = {'users': 100000, 'courses': 10000, 'enrollments': 1000000, 'attempts': 5000000}
+QUIZZES_PER_COURSE = 2
+QUESTIONS_PER_QUIZ = 5
+INSERT_CHUNK_SIZE = 20000
+
+# Statements issued by the thread currently driving a request through the test client
+query_counter = threading.local()
+
+
+# SQLite's single writer lock and Postgres lock conflicts; the app may turn these into a flash and a redirect
+LOCK_ERRORS = ('database is locked', 'database table is locked', 'deadlock detected', 'could not obtain lock')
+# Scenarios that write; on SQLite their concurrent phase mostly measures the database-wide write lock
+WRITE_SCENARIOS = ('take_and_submit_quiz', 'api_enroll')
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    query_counter.count = getattr(query_counter, 'count', 0) + 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def count_lock_error(context):
+    if any(message in str(context.original_exception) for message in LOCK_ERRORS):
+        query_counter.lock_errors = getattr(query_counter, 'lock_errors', 0) + 1
+
+
+def insert_chunked(model, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == INSERT_CHUNK_SIZE:
+            db.session.execute(insert(model), chunk)
+            db.session.commit()
+            chunk = []
+    if chunk:
+        db.session.execute(insert(model), chunk)
+        db.session.commit()
+
+
+def seed(scale):
+    counts = {name: max(int(volume * scale), 1) for name, volume in VOLUMES.items()}
+    users, courses = max(counts['users'], 100), max(counts['courses'], 10)
+    teachers = users // 50
+    students = range(teachers + 1, users + 1)
+    per_student = max(min(counts['enrollments'] // len(students), courses), 1)
+    quizzes = courses * QUIZZES_PER_COURSE
+    print(f"Seeding {users} users, {courses} courses, {len(students) * per_student} enrollments, "
+          f"{quizzes} quizzes, {counts['attempts']} attempts...")
+    rng = random.Random(42)
+    started = time.perf_counter()
+
+    # User 1 is the admin, the next `teachers - 1` ids teach, the rest are students
+    insert_chunked(User, (
+        {'id': i, 'name': f'User {i}', 'email': f'user{i}@example.com', 'password': 'x',
+         'role': 'admin' if i == 1 else 'teacher' if i <= teachers else 'student', 'email_verified': True}
+        for i in range(1, users + 1)
+    ))
+    course_teachers = [rng.randint(2, teachers) for _ in range(courses)]
+    insert_chunked(Course, (
+        {'id': i, 'title': f'Course {i}', 'description': f'Benchmark course about topic {i % 97}',
+         'price': 0, 'teacher_id': course_teachers[i - 1]}
+        for i in range(1, courses + 1)
+    ))
+    insert_chunked(Enrollment, (
+        {'student_id': student_id, 'course_id': course_id}
+        for student_id in students
+        for course_id in rng.sample(range(1, courses + 1), per_student)
+    ))
+    insert_chunked(Quiz, (
+        {'id': i, 'course_id': (i - 1) // QUIZZES_PER_COURSE + 1, 'title': f'Quiz {i}', 'passing_score': 60,
+         'created_by': course_teachers[(i - 1) // QUIZZES_PER_COURSE], 'version': 1}
+        for i in range(1, quizzes + 1)
+    ))
+    insert_chunked(Question, (
+        {'quiz_id': quiz_id, 'question_text': f'Q{n}', 'options': '["a", "b", "c", "d"]',
+         'correct_answer': 'a', 'points': 1, 'order': n}
+        for quiz_id in range(1, quizzes + 1)
+        for n in range(1, QUESTIONS_PER_QUIZ + 1)
+    ))
+    epoch = datetime(2024, 1, 1)
+    insert_chunked(QuizAttempt, (
+        {'quiz_id': rng.randint(1, quizzes), 'student_id': rng.randint(teachers + 1, users),
+         'answers': '{}', 'score': score, 'max_score': QUESTIONS_PER_QUIZ,
+         'percentage': score * 100 / QUESTIONS_PER_QUIZ, 'passed': score * 100 / QUESTIONS_PER_QUIZ >= 60,
+         'started_at': epoch + timedelta(seconds=n * 5), 'submitted_at': epoch + timedelta(seconds=n * 5 + 300)}
+        for n, score in ((n, rng.randint(0, QUESTIONS_PER_QUIZ)) for n in range(counts['attempts']))
+    ))
+    insert_chunked(Payment, (
+        {'student_id': rng.randint(teachers + 1, users), 'course_id': rng.randint(1, courses), 'amount': 499,
+         'currency': 'INR', 'payment_gateway': 'stripe', 'order_id': f'cs_bench_{i}', 'status': 'completed',
+         'updated_at': epoch + timedelta(hours=i)}
+        for i in range(courses * 2)
+    ))
+    for start in range(1, quizzes + 1, 1000):
+        rebuild_quiz_summaries(list(range(start, min(start + 1000, quizzes + 1))))
+        db.session.commit()
+    rebuild_revenue_rollups()
+    db.session.commit()
+    ensure_model_indexes()
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+    print(f"✓ Seeded in {time.perf_counter() - started:.1f}s")
+
+
+def sample_actors(rng, size=500):
+    """Real ids to drive the routes with: students with an enrolled quiz, teachers with courses"""
+    pairs = db.session.execute(text(
+        'SELECT e.student_id, q.id FROM enrollments e JOIN quizzes q ON q.course_id = e.course_id '
+        'ORDER BY RANDOM() LIMIT :size'
+    ), {'size': size}).all()
+    teachers = [row[0] for row in db.session.execute(text(
+        'SELECT DISTINCT teacher_id FROM courses WHERE teacher_id IS NOT NULL ORDER BY teacher_id LIMIT :size'
+    ), {'size': size})]
+    courses = db.session.query(db.func.max(Course.id)).scalar()
+    if not pairs or not teachers:
+        raise SystemExit("No seeded data found; run without --skip-seed first")
+    rng.shuffle(teachers)
+    return {'student_quizzes': pairs, 'teachers': teachers, 'courses': courses, 'admin': 1}
+
+
+def login(client, user_id, role):
+    with client.session_transaction() as sess:
+        sess['id'] = user_id
+        sess['role'] = role
+        sess['name'] = f'User {user_id}'
+
+
+def take_and_submit(client, rng, actors):
+    student_id, quiz_id = rng.choice(actors['student_quizzes'])
+    login(client, student_id, 'student')
+    page = client.get(f'/quiz/{quiz_id}/take')
+    token = re.search(rb'name="attempt_token" value="([^"]+)"', page.data)
+    if not token:
+        return [page]
+    answers = {'attempt_token': token.group(1).decode()}
+    answers.update({key: rng.choice('abcd') for key in
+                    {m.decode() for m in re.findall(rb'name="(question_\d+)"', page.data)}})
+    return [page, client.post(f'/quiz/{quiz_id}/submit', data=answers)]
+
+
+def as_user(role, path):
+    """A scenario that logs in as a random actor of `role` and GETs `path` (formatted with its id)"""
+    def run(client, rng, actors):
+        if role == 'student':
+            user_id = rng.choice(actors['student_quizzes'])[0]
+        elif role == 'teacher':
+            user_id = rng.choice(actors['teachers'])
+        else:
+            user_id = actors['admin']
+        login(client, user_id, role)
+        return [client.get(path.format(id=user_id, page=rng.randint(1, 20), topic=rng.randint(0, 96)))]
+    return run
+
+
+def api_enroll(client, rng, actors):
+    student_id = rng.choice(actors['student_quizzes'])[0]
+    return [client.post('/api/enroll', json={'student_id': student_id, 'course_id': rng.randint(1, actors['courses'])})]
+
+
+SCENARIOS = {
+    'student_dashboard': as_user('student', '/student/{id}'),
+    'student_dashboard_search': as_user('student', '/student/{id}?q=topic+{topic}'),
+    'teacher_dashboard': as_user('teacher', '/teacher/{id}'),
+    'teacher_quiz_tracker': as_user('teacher', '/teacher/{id}/quiz-tracker'),
+    'admin_dashboard': as_user('admin', '/admin'),
+    'take_and_submit_quiz': take_and_submit,
+    'api_courses': as_user('student', '/api/courses?page={page}'),
+    'api_student_courses': as_user('student', '/api/student/{id}/courses'),
+    'api_teacher_dashboard': as_user('teacher', '/api/teacher/{id}/dashboard'),
+    'api_enroll': api_enroll,
+}
+
+
+def run_once(scenario, client, rng, actors):
+    """One scenario iteration: (latency ms, statements, failed, lock errors)"""
+    query_counter.count = 0
+    query_counter.lock_errors = 0
+    started = time.perf_counter()
+    # Setting the session cookie falls inside the timer; it is well under a millisecond and runs no SQL
+    responses = scenario(client, rng, actors)
+    elapsed = (time.perf_counter() - started) * 1000
+    # A lock error counts even when the route caught it and answered with a redirect
+    failed = query_counter.lock_errors > 0 or any(response.status_code >= 500 for response in responses)
+    return elapsed, query_counter.count, failed, query_counter.lock_errors
+
+
+def measure(name, actors, requests_per_scenario, concurrency, duration):
+    scenario = SCENARIOS[name]
+
+    # Serial pass: steady-state latency and statement counts without contention
+    client, rng = app.test_client(), random.Random(name)
+    run_once(scenario, client, rng, actors)  # warm caches and connections
+    serial = [run_once(scenario, client, rng, actors) for _ in range(requests_per_scenario)]
+
+    # Concurrent pass: each worker gets its own client and hammers the route for `duration` seconds
+    deadline = time.perf_counter() + duration
+
+    def worker(seed):
+        worker_client, worker_rng = app.test_client(), random.Random(seed)
+        results = []
+        while time.perf_counter() < deadline:
+            results.append(run_once(scenario, worker_client, worker_rng, actors))
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        loaded = [result for results in pool.map(worker, range(concurrency)) for result in results]
+    wall = time.perf_counter() - started
+
+    serial_latency = sorted(result[0] for result in serial)
+    loaded_latency = sorted(result[0] for result in loaded)
+    queries = sorted(result[1] for result in serial)
+    return {
+        'serial_p50_ms': round(percentile(serial_latency, 50), 2),
+        'serial_p95_ms': round(percentile(serial_latency, 95), 2),
+        'queries_p50': percentile(queries, 50),
+        'queries_max': queries[-1],
+        'requests': len(loaded),
+        'errors': sum(result[2] for result in serial + loaded),
+        'lock_errors': sum(result[3] for result in serial + loaded),
+        'throughput_rps': round(len(loaded) / wall, 1) if wall else 0,
+        'p50_ms': round(percentile(loaded_latency, 50), 2) if loaded else None,
+        'p95_ms': round(percentile(loaded_latency, 95), 2) if loaded else None,
+        'p99_ms': round(percentile(loaded_latency, 99), 2) if loaded else None,
+    }
+
+
+def ms(value, width, align='>'):
+    """Latency cell; a load pass that finished no requests has no percentiles"""
+    return f"{value:{align}{width}.1f}" if value is not None else f"{'-':{align}{width}}"
+
+
+def compare(results, baseline, tolerance):
+    """Print deltas against a saved run; returns the scenarios that regressed"""
+    regressions = []
+    print(f"\n{'scenario':<28}{'p95 (ms)':>22}{'throughput (rps)':>26}{'queries':>12}{'errors':>12}{'locks':>12}")
+    for name, current in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            print(f"{name:<28}{'(not in baseline)':>22}")
+            continue
+        if current['p95_ms'] is None:
+            p95_change = None  # Nothing finished under load, which is a regression by itself
+        elif before['p95_ms']:
+            p95_change = (current['p95_ms'] - before['p95_ms']) / before['p95_ms']
+        else:
+            p95_change = 0
+        rps_change = ((current['throughput_rps'] - before['throughput_rps']) / before['throughput_rps']
+                      if before['throughput_rps'] else 0)
+        # Baselines saved before lock errors were counted have no 'lock_errors'
+        errors_before, locks_before = before.get('errors', 0), before.get('lock_errors', 0)
+        regressed = (p95_change is None or p95_change > tolerance or rps_change < -tolerance
+                     or current['queries_max'] > before['queries_max']
+                     or current['errors'] > errors_before or current['lock_errors'] > locks_before)
+        if regressed:
+            regressions.append(name)
+        p95_delta = f"{p95_change:>+5.0%}" if p95_change is not None else f"{'-':>5}"
+        print(f"{name:<28}{ms(before['p95_ms'], 9)} -> {ms(current['p95_ms'], 8, '<')}{p95_delta}"
+              f"{before['throughput_rps']:>11.1f} -> {current['throughput_rps']:<8.1f}{rps_change:>+5.0%}"
+              f"{before['queries_max']:>5} -> {current['queries_max']:<3}"
+              f"{errors_before:>5} -> {current['errors']:<4}{locks_before:>5} -> {current['lock_errors']:<4}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the hot routes against a seeded database')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='fraction of 100k users / 10k courses / 1M enrollments / 5M attempts to seed')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the data from a previous run')
+    parser.add_argument('--scenarios', nargs='*', choices=sorted(SCENARIOS), help='subset to run (default: all)')
+    parser.add_argument('--requests', type=int, default=50, help='serial requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads in the load phase')
+    parser.add_argument('--duration', type=float, default=5, help='seconds of load per scenario')
+    parser.add_argument('--save-baseline', metavar='FILE', help='write the results as a baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p95/throughput drift before a scenario counts as regressed')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not args.skip_seed:
+            db.drop_all()
+            db.create_all()
+            seed(args.scale)
+        actors = sample_actors(random.Random(7))
+        dialect = db.engine.dialect.name
+
+    scenarios = args.scenarios or list(SCENARIOS)
+    if dialect == 'sqlite' and args.concurrency > 1 and set(scenarios) & set(WRITE_SCENARIOS):
+        print(f"! Note: {', '.join(sorted(set(scenarios) & set(WRITE_SCENARIOS)))} write concurrently on SQLite; "
+              f"expect lock errors and point BENCHMARK_DATABASE_URL at Postgres for meaningful numbers")
+
+    results = {}
+    print(f"\n{'scenario':<28}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'serial p50':>12}{'queries':>9}"
+          f"{'errors':>8}{'locks':>7}")
+    for name in scenarios:
+        result = results[name] = measure(name, actors, args.requests, args.concurrency, args.duration)
+        print(f"{name:<28}{result['throughput_rps']:>8.1f}{ms(result['p50_ms'], 9)}{ms(result['p95_ms'], 9)}"
+              f"{ms(result['p99_ms'], 9)}{result['serial_p50_ms']:>12.1f}{result['queries_max']:>9}{result['errors']:>8}"
+              f"{result['lock_errors']:>7}")
+
+    run = {
+        'recorded_at': datetime.utcnow().isoformat(),
+        'dialect': dialect,
+        'scale': args.scale,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'results': results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"\n✓ Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline.get('dialect'), baseline.get('scale')) != (dialect, args.scale):
+            print(f"! Note: baseline was recorded on {baseline.get('dialect')} at scale {baseline.get('scale')}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            raise SystemExit(f"Regressed: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
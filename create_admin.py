@@ -1,4 +1,4 @@
-from app import app, db, User
+from app import app, db, User, password_hasher
 import os
 from dotenv import load_dotenv
 
@@ -17,7 +17,7 @@ def create_admin():
             admin = User(
                 name='Admin User',
                 email=admin_email,
-                password=admin_password,
+                password=password_hasher.hash(admin_password),
                 role='admin',
                 email_verified=True
             )
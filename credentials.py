@@ -0,0 +1,50 @@
+"""Password hashing and verification with a tunable cost.
+
+Hashes use werkzeug's self-describing "method$salt$hash" format, so the cost
+settings travel with each row and can be raised later: a successful login
+against an older (or plaintext) value reports that the row should be
+rehashed with the current method. Every comparison is constant-time, and
+unknown accounts are checked against a dummy hash so a miss costs the same
+as a wrong password.
+"""
+import hmac
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'scrypt:16384:8:1'  # ~50 ms per check on one core; raise it with PASSWORD_HASH_METHOD
+HASH_PREFIXES = ('scrypt:', 'pbkdf2:')
+
+
+def is_hashed(stored):
+    return bool(stored) and stored.startswith(HASH_PREFIXES) and stored.count('$') == 2
+
+
+class PasswordHasher:
+    __slots__ = ('method', 'method_tag', 'dummy_hash')
+
+    def __init__(self, method=DEFAULT_METHOD):
+        self.method = method
+        # werkzeug fills in defaults (e.g. pbkdf2 iterations), so compare against what it actually writes
+        self.dummy_hash = generate_password_hash('dummy-password', method=method)
+        self.method_tag = self.dummy_hash.split('$', 1)[0]
+
+    def hash(self, password):
+        return generate_password_hash(password, method=self.method)
+
+    def verify(self, stored, password):
+        """Check a password against a stored value; returns (matches, needs_rehash).
+
+        Pass stored=None for an unknown account to spend the same time as a real check.
+        """
+        if stored is None:
+            check_password_hash(self.dummy_hash, password)
+            return False, False
+        if is_hashed(stored):
+            matches = check_password_hash(stored, password)
+            return matches, matches and stored.split('$', 1)[0] != self.method_tag
+        # Legacy plaintext row: compare in constant time, then have the caller hash it. A miss still
+        # pays for one hash so it looks like any other wrong password; a match pays for it in the rehash.
+        matches = hmac.compare_digest(stored.encode('utf-8'), password.encode('utf-8'))
+        if not matches:
+            check_password_hash(self.dummy_hash, password)
+        return matches, matches
@@ -0,0 +1,23 @@
+import argparse
+import time
+
+from app import app, deliver_outbox
+
+
+def run(loop, interval):
+    with app.app_context():
+        while True:
+            sent = deliver_outbox()
+            if sent:
+                print(f"✓ Sent {sent} queued emails")
+            if not loop:
+                break
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Deliver queued emails from the outbox table')
+    parser.add_argument('--loop', action='store_true', help='keep polling instead of draining once')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between polls with --loop')
+    args = parser.parse_args()
+    run(args.loop, args.interval)
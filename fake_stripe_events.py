@@ -0,0 +1,80 @@
+import argparse
+import hashlib
+import hmac
+import json
+import secrets
+import time
+import urllib.request
+
+import app as application
+from app import app, Payment
+
+
+def checkout_event(payment, event_type, event_id=None):
+    """A checkout.session.* event shaped like the ones Stripe sends for this pending payment"""
+    return {
+        'id': event_id or f'evt_fake_{secrets.token_hex(12)}',
+        'object': 'event',
+        'type': event_type,
+        'created': int(time.time()),
+        'data': {'object': {
+            'id': payment.order_id,
+            'object': 'checkout.session',
+            'payment_status': 'paid' if event_type == 'checkout.session.completed' else 'unpaid',
+            'payment_intent': f'pi_fake_{payment.id}',
+            'amount_total': int(payment.amount * 100) if payment.amount is not None else 0,
+            'currency': (payment.currency or 'inr').lower(),
+            'client_reference_id': str(payment.student_id),
+            'metadata': {'course_id': str(payment.course_id), 'student_id': str(payment.student_id)},
+        }},
+    }
+
+
+def signature_header(payload, secret, timestamp=None):
+    # Same scheme stripe.Webhook.construct_event verifies: HMAC-SHA256 over "<timestamp>.<payload>"
+    timestamp = timestamp or int(time.time())
+    signed = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signed}'
+
+
+def send(event, secret, url=None):
+    payload = json.dumps(event)
+    headers = {'Content-Type': 'application/json', 'Stripe-Signature': signature_header(payload, secret)}
+    if url:
+        request = urllib.request.Request(url, data=payload.encode(), headers=headers, method='POST')
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    return app.test_client().post('/stripe/webhook', data=payload, headers=headers).status_code
+
+
+def run(order_ids, event_type, url, repeat):
+    secret = application.stripe_webhook_secret
+    if not secret:
+        # Local runs without a configured secret sign with a throwaway one the app is told about
+        secret = application.stripe_webhook_secret = f'whsec_fake_{secrets.token_hex(8)}'
+        if url:
+            print("! STRIPE_WEBHOOK_SECRET is not set; the remote app will reject these events")
+
+    with app.app_context():
+        query = Payment.query.filter_by(payment_gateway='stripe', status='pending')
+        if order_ids:
+            query = query.filter(Payment.order_id.in_(order_ids))
+        for payment in query.all():
+            event = checkout_event(payment, event_type)
+            # --repeat resends the same event id to exercise the idempotent event table
+            for _ in range(repeat):
+                status = send(event, secret, url)
+                print(f"✓ {event['type']} for {payment.order_id} -> {status}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Send signed fake Stripe checkout events for pending payments')
+    parser.add_argument('order_ids', nargs='*', help='checkout session ids to complete (default: every pending payment)')
+    parser.add_argument('--type', default='checkout.session.completed',
+                        choices=['checkout.session.completed', 'checkout.session.expired',
+                                 'checkout.session.async_payment_failed'])
+    parser.add_argument('--url', help='post to a running app (e.g. http://localhost:5000/stripe/webhook) '
+                                      'instead of the in-process test client')
+    parser.add_argument('--repeat', type=int, default=1, help='deliveries of each event')
+    args = parser.parse_args()
+    run(args.order_ids, args.type, args.url, args.repeat)
@@ -0,0 +1,111 @@
+"""Quiz grading against a compact, precompiled answer key.
+
+The key holds one quiz's question ids, correct answers and point weights as
+parallel tuples, built once per quiz version. Grading a submission is then a
+single pass over those tuples with no ORM objects involved, and a batch of
+submissions reuses the same key.
+"""
+
+
+class AnswerKey:
+    __slots__ = ('question_ids', 'fields', 'correct_answers', 'points', 'max_score')
+
+    def __init__(self, question_ids, correct_answers, points):
+        self.question_ids = tuple(question_ids)
+        # Form field each answer arrives in, and the key it is stored under in QuizAttempt.answers
+        self.fields = tuple(f'question_{question_id}' for question_id in self.question_ids)
+        self.correct_answers = tuple(correct_answers)
+        self.points = tuple(points)
+        self.max_score = sum(self.points)
+
+
+def build_answer_key(questions):
+    """Build an AnswerKey from (id, correct_answer, points) rows"""
+    rows = list(questions)
+    return AnswerKey(
+        [row[0] for row in rows],
+        [row[1] for row in rows],
+        [row[2] if row[2] is not None else 1 for row in rows]
+    )
+
+
+def collect_answers(key, form):
+    """Pull one submission's answers out of a form, keyed by str(question id) like QuizAttempt.answers"""
+    return {str(question_id): form.get(field) for question_id, field in zip(key.question_ids, key.fields)}
+
+
+def score_answers(key, answers):
+    """Score answers keyed by str(question id)"""
+    return sum(
+        points
+        for question_id, correct, points in zip(key.question_ids, key.correct_answers, key.points)
+        if answers.get(str(question_id)) == correct
+    )
+
+
+def grade_batch(key, submissions):
+    """Score many submissions in one pass over the key; returns scores in submission order"""
+    scores = [0] * len(submissions)
+    for question_id, correct, points in zip(key.question_ids, key.correct_answers, key.points):
+        question_id = str(question_id)
+        for index, answers in enumerate(submissions):
+            if answers.get(question_id) == correct:
+                scores[index] += points
+    return scores
+
+
+def percentage(score, max_score):
+    return (score / max_score * 100) if max_score > 0 else 0
+
+
+class ItemStatistics:
+    """Streaming per-question difficulty and discrimination over batches of graded submissions.
+
+    Difficulty is the share of submissions answering the question correctly.
+    Discrimination is the point-biserial correlation between getting the
+    question right and the submission's total score. Only running sums are
+    kept, so memory stays flat however many attempts are fed in.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.correct = [0] * len(key.question_ids)
+        self.total_when_correct = [0.0] * len(key.question_ids)
+
+    def add_batch(self, submissions, scores):
+        self.count += len(submissions)
+        self.total += sum(scores)
+        self.total_squares += sum(score * score for score in scores)
+        for index, (question_id, correct) in enumerate(zip(self.key.question_ids, self.key.correct_answers)):
+            question_id = str(question_id)
+            for answers, score in zip(submissions, scores):
+                if answers.get(question_id) == correct:
+                    self.correct[index] += 1
+                    self.total_when_correct[index] += score
+
+    def results(self):
+        n = self.count
+        mean = self.total / n if n else 0.0
+        variance = self.total_squares / n - mean * mean if n else 0.0
+        deviation = variance ** 0.5 if variance > 0 else 0.0
+
+        results = []
+        for index, question_id in enumerate(self.key.question_ids):
+            right = self.correct[index]
+            wrong = n - right
+            difficulty = right / n if n else None
+            discrimination = None
+            if right and wrong and deviation:
+                mean_right = self.total_when_correct[index] / right
+                mean_wrong = (self.total - self.total_when_correct[index]) / wrong
+                discrimination = (mean_right - mean_wrong) / deviation * (difficulty * (1 - difficulty)) ** 0.5
+            results.append({
+                'question_id': question_id,
+                'correct': right,
+                'difficulty': difficulty,
+                'discrimination': discrimination,
+            })
+        return results
@@ -1,6 +1,8 @@
-from app import app, db
+from app import (app, db, Course, CourseMaterial, Quiz, QuizAttempt, QuizSummary, RevenueRollup,
+                 COURSE_SEARCH_DOCUMENT, next_material_position, rebuild_quiz_summaries, rebuild_revenue_rollups)
 from sqlalchemy import text
 import os
+import json
 
 def migrate():
     with app.app_context():
@@ -22,6 +24,14 @@ def migrate():
                 print(f"✓ Column {col} ensured in users table")
             except Exception as e:
                 print(f"! Note for {col} in users: {e}")
+
+        # Password hashes are longer than the old plaintext column allowed (SQLite ignores lengths)
+        if db.engine.dialect.name == 'postgresql':
+            try:
+                db.session.execute(text('ALTER TABLE users ALTER COLUMN password TYPE VARCHAR(255)'))
+                print("✓ Column password widened in users table")
+            except Exception as e:
+                print(f"! Note for password in users: {e}")
                 
         # 3. Add columns to COURSES if they don't exist
         cols_courses = [
@@ -35,6 +45,25 @@ def migrate():
             except Exception as e:
                 print(f"! Note for {col} in courses: {e}")
 
+        # 3b. Add columns to QUIZZES if they don't exist
+        try:
+            db.session.execute(text('ALTER TABLE quizzes ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1'))
+            print("✓ Column version ensured in quizzes table")
+        except Exception as e:
+            print(f"! Note for version in quizzes: {e}")
+
+        # 3c. Add columns to PAYMENTS if they don't exist
+        cols_payments = [
+            ('checkout_url', 'TEXT'),
+            ('expires_at', 'TIMESTAMP')
+        ]
+        for col, type in cols_payments:
+            try:
+                db.session.execute(text(f'ALTER TABLE payments ADD COLUMN IF NOT EXISTS {col} {type}'))
+                print(f"✓ Column {col} ensured in payments table")
+            except Exception as e:
+                print(f"! Note for {col} in payments: {e}")
+
         # 4. Add columns to ENROLLMENTS if they don't exist
         try:
             db.session.execute(text('ALTER TABLE enrollments ADD COLUMN IF NOT EXISTS enrolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP'))
@@ -50,7 +79,291 @@ def migrate():
         db.session.commit()
         print("✓ Existing admins and teachers marked as verified")
         
+        # 6. Course catalog search index
+        ensure_course_search_index()
+
+        # 7. Indexes and foreign keys on hot lookup columns
+        dedupe_enrollments()
+        dedupe_pending_payments()
+        dedupe_material_positions()
+        dedupe_quiz_attempts()
+        ensure_model_indexes()
+        drop_replaced_indexes()
+        ensure_foreign_keys()
+
+        # 8. Move Course.materials JSON blobs into course_materials rows
+        migrate_course_materials()
+
+        # 9. Backfill per-quiz attempt rollups for the quiz tracker
+        backfill_quiz_summaries()
+
+        # 10. Backfill revenue rollups for admin reporting
+        backfill_revenue_rollups()
+
         print("\nMigration completed successfully!")
 
+def ensure_course_search_index():
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_courses_search '
+                f'ON courses USING GIN ({COURSE_SEARCH_DOCUMENT})'
+            ))
+            print("✓ Full-text search index ensured on courses")
+            try:
+                conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                conn.execute(text(
+                    'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_courses_title_trgm '
+                    'ON courses USING GIN (title gin_trgm_ops)'
+                ))
+                print("✓ Trigram index ensured on courses.title")
+            except Exception as e:
+                print(f"! Note for trigram index on courses: {e}")
+    elif dialect == 'sqlite':
+        try:
+            statements = [
+                "CREATE VIRTUAL TABLE IF NOT EXISTS courses_fts USING fts5("
+                "title, description, content='courses', content_rowid='id')",
+                "CREATE TRIGGER IF NOT EXISTS courses_fts_ai AFTER INSERT ON courses BEGIN "
+                "INSERT INTO courses_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+                "CREATE TRIGGER IF NOT EXISTS courses_fts_ad AFTER DELETE ON courses BEGIN "
+                "INSERT INTO courses_fts(courses_fts, rowid, title, description) "
+                "VALUES ('delete', old.id, old.title, old.description); END",
+                "CREATE TRIGGER IF NOT EXISTS courses_fts_au AFTER UPDATE OF title, description ON courses BEGIN "
+                "INSERT INTO courses_fts(courses_fts, rowid, title, description) "
+                "VALUES ('delete', old.id, old.title, old.description); "
+                "INSERT INTO courses_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+                "INSERT INTO courses_fts(courses_fts) VALUES ('rebuild')",
+            ]
+            for statement in statements:
+                db.session.execute(text(statement))
+            db.session.commit()
+            print("✓ FTS5 search table ensured for courses")
+        except Exception as e:
+            db.session.rollback()
+            print(f"! Note for courses FTS5 table: {e}")
+
+def dedupe_enrollments():
+    # The unique (student_id, course_id) index can't be built while duplicates exist
+    result = db.session.execute(text(
+        'DELETE FROM enrollments WHERE id NOT IN '
+        '(SELECT MIN(id) FROM enrollments GROUP BY student_id, course_id)'
+    ))
+    db.session.commit()
+    print(f"✓ Removed {result.rowcount} duplicate enrollments")
+
+def dedupe_pending_payments():
+    # Only the newest pending checkout per student and course survives the partial unique index
+    result = db.session.execute(text(
+        "UPDATE payments SET status = 'expired' WHERE status = 'pending' AND id NOT IN "
+        "(SELECT MAX(id) FROM payments WHERE status = 'pending' GROUP BY student_id, course_id)"
+    ))
+    db.session.commit()
+    print(f"✓ Expired {result.rowcount} duplicate pending payments")
+
+def dedupe_quiz_attempts():
+    # Concurrent submits could store one quiz session twice; keep the submitted copy (the first one if
+    # both or neither were submitted) and recount the affected quizzes so their summaries stop counting the copies
+    ranked = (
+        db.session.query(
+            QuizAttempt.id,
+            QuizAttempt.quiz_id,
+            db.func.row_number().over(
+                partition_by=(QuizAttempt.student_id, QuizAttempt.quiz_id, QuizAttempt.started_at),
+                order_by=(QuizAttempt.submitted_at.is_(None), QuizAttempt.id)
+            ).label('rank')
+        )
+        .filter(QuizAttempt.started_at.isnot(None))
+        .subquery()
+    )
+    rows = db.session.query(ranked.c.id, ranked.c.quiz_id).filter(ranked.c.rank > 1).all()
+    if rows:
+        QuizAttempt.query.filter(QuizAttempt.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+        rebuild_quiz_summaries(sorted({row.quiz_id for row in rows}))
+    db.session.commit()
+    print(f"✓ Removed {len(rows)} duplicate quiz attempts")
+
+def dedupe_material_positions():
+    # The unique (course_id, position) index can't be built while two uploads share a slot;
+    # renumber only the affected courses, keeping the current order
+    course_ids = [
+        course_id for (course_id,) in
+        db.session.query(CourseMaterial.course_id)
+        .group_by(CourseMaterial.course_id, CourseMaterial.position)
+        .having(db.func.count(CourseMaterial.id) > 1)
+        .distinct()
+    ]
+    for course_id in course_ids:
+        materials = (
+            CourseMaterial.query.filter_by(course_id=course_id)
+            .order_by(CourseMaterial.position, CourseMaterial.id)
+            .all()
+        )
+        for position, material in enumerate(materials, start=1):
+            material.position = position
+    db.session.commit()
+    print(f"✓ Renumbered materials for {len(course_ids)} courses with duplicate positions")
+
+def drop_replaced_indexes(names=('ix_course_materials_course_position', 'ix_quiz_attempts_student_quiz',
+                                 'ix_quiz_attempts_quiz_id')):
+    # Superseded by unique indexes over the same columns
+    for name in names:
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                    conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+            else:
+                db.session.execute(text(f'DROP INDEX IF EXISTS {name}'))
+                db.session.commit()
+            print(f"✓ Index {name} dropped if present")
+        except Exception as e:
+            db.session.rollback()
+            print(f"! Note for index {name}: {e}")
+
+def index_ddl(index, concurrently=False):
+    quote = db.engine.dialect.identifier_preparer.quote
+    columns = ', '.join(quote(column.name) for column in index.columns)
+    where = index.dialect_kwargs.get(f'{db.engine.dialect.name}_where')
+    return (
+        f"CREATE {'UNIQUE ' if index.unique else ''}INDEX "
+        f"{'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS "
+        f"{index.name} ON {index.table.name} ({columns})"
+        f"{f' WHERE {where}' if where is not None else ''}"
+    )
+
+def ensure_model_indexes():
+    # Create every index declared on the models, without locking writes on Postgres
+    indexes = [index for table in db.metadata.sorted_tables for index in table.indexes]
+
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            for index in indexes:
+                # A failed CONCURRENTLY build leaves an invalid index that IF NOT EXISTS would skip
+                invalid = conn.execute(text(
+                    'SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid '
+                    'WHERE c.relname = :name AND NOT i.indisvalid'
+                ), {'name': index.name}).first()
+                if invalid:
+                    conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index.name}'))
+                try:
+                    conn.execute(text(index_ddl(index, concurrently=True)))
+                    print(f"✓ Index {index.name} ensured")
+                except Exception as e:
+                    print(f"! Note for index {index.name}: {e}")
+    else:
+        for index in indexes:
+            try:
+                db.session.execute(text(index_ddl(index)))
+                db.session.commit()
+                print(f"✓ Index {index.name} ensured")
+            except Exception as e:
+                db.session.rollback()
+                print(f"! Note for index {index.name}: {e}")
+
+def ensure_foreign_keys():
+    if db.engine.dialect.name != 'postgresql':
+        # SQLite can't add constraints to an existing table; new databases get them from create_all
+        print("! Skipping foreign key backfill: only supported on Postgres")
+        return
+
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for table in db.metadata.sorted_tables:
+            for fk in table.foreign_keys:
+                column = fk.parent.name
+                name = f'{table.name}_{column}_fkey'
+                existing = conn.execute(text(
+                    'SELECT convalidated FROM pg_constraint WHERE conname = :name'
+                ), {'name': name}).first()
+                if existing and existing.convalidated:
+                    continue
+                try:
+                    # NOT VALID skips the full-table check under lock; VALIDATE then scans without blocking writes.
+                    # A constraint left NOT VALID by an earlier failed run only needs the VALIDATE retried.
+                    if not existing:
+                        conn.execute(text(
+                            f'ALTER TABLE {table.name} ADD CONSTRAINT {name} FOREIGN KEY ({column}) '
+                            f'REFERENCES {fk.column.table.name} ({fk.column.name}) NOT VALID'
+                        ))
+                    conn.execute(text(f'ALTER TABLE {table.name} VALIDATE CONSTRAINT {name}'))
+                    print(f"✓ Foreign key {name} ensured")
+                except Exception as e:
+                    print(f"! Note for foreign key {name}: {e}")
+
+def migrate_course_materials(batch_size=500):
+    # Each course is converted and its blob cleared in the same commit, so reruns skip it
+    migrated = 0
+    last_id = 0
+    while True:
+        courses = (
+            Course.query
+            .filter(Course.id > last_id, Course.materials.isnot(None), Course.materials != '')
+            .order_by(Course.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not courses:
+            break
+        for course in courses:
+            last_id = course.id
+            try:
+                materials = json.loads(course.materials)
+            except ValueError:
+                print(f"! Note for course {course.id}: unreadable materials JSON left as-is")
+                continue
+            # Rows uploaded since the deploy keep their positions; legacy ones follow them
+            start = next_material_position(course.id)
+            try:
+                rows = [
+                    CourseMaterial(
+                        course_id=course.id,
+                        position=position,
+                        name=material.get('name'),
+                        path=material.get('path'),
+                        type=material.get('type'),
+                        cloudinary_id=material.get('cloudinary_id')
+                    )
+                    for position, material in enumerate(materials, start=start)
+                ]
+            except (TypeError, AttributeError):
+                # Valid JSON that isn't a list of objects (null, a dict, a list of strings)
+                print(f"! Note for course {course.id}: materials JSON is not a list of objects, left as-is")
+                continue
+            db.session.add_all(rows)
+            course.materials = ''
+            migrated += len(rows)
+        db.session.commit()
+    print(f"✓ Moved {migrated} course materials into course_materials")
+
+def backfill_quiz_summaries(batch_size=500):
+    # Only quizzes without a summary row are touched, so live rollups are never recomputed
+    built = 0
+    last_id = 0
+    while True:
+        quiz_ids = [
+            quiz_id for (quiz_id,) in
+            db.session.query(Quiz.id)
+            .outerjoin(QuizSummary, QuizSummary.quiz_id == Quiz.id)
+            .filter(Quiz.id > last_id, QuizSummary.quiz_id.is_(None))
+            .order_by(Quiz.id)
+            .limit(batch_size)
+        ]
+        if not quiz_ids:
+            break
+        rebuild_quiz_summaries(quiz_ids)
+        db.session.commit()
+        last_id = quiz_ids[-1]
+        built += len(quiz_ids)
+    print(f"✓ Built attempt summaries for {built} quizzes")
+
+def backfill_revenue_rollups():
+    # Always a full rebuild: payments finalized before this runs already own rollup rows, so
+    # "table is non-empty" doesn't mean history was backfilled. Rebuilding is idempotent, and a
+    # payment finalized meanwhile waits on the rebuilt rows and then adds itself on top.
+    rebuild_revenue_rollups()
+    db.session.commit()
+    print(f"✓ Rebuilt {RevenueRollup.query.count()} revenue rollup rows from completed payments")
+
 if __name__ == "__main__":
     migrate()
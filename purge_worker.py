@@ -0,0 +1,23 @@
+import argparse
+import time
+
+from app import app, process_user_purges
+
+
+def run(loop, interval):
+    with app.app_context():
+        while True:
+            purged = process_user_purges()
+            if purged:
+                print(f"✓ Deleted {purged} queued accounts")
+            if not loop:
+                break
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Finish account deletions queued from the admin dashboard')
+    parser.add_argument('--loop', action='store_true', help='keep polling instead of draining once')
+    parser.add_argument('--interval', type=float, default=30, help='seconds between polls with --loop')
+    args = parser.parse_args()
+    run(args.loop, args.interval)
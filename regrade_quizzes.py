@@ -0,0 +1,24 @@
+import argparse
+
+from app import app, Quiz, regrade_quiz
+
+
+def run(quiz_ids):
+    with app.app_context():
+        query = Quiz.query.order_by(Quiz.id)
+        if quiz_ids:
+            query = query.filter(Quiz.id.in_(quiz_ids))
+        for quiz in query.all():
+            regraded, questions = regrade_quiz(quiz)
+            print(f"✓ Quiz {quiz.id} ({quiz.title}): regraded {regraded} attempts")
+            for item in questions:
+                difficulty = f"{item['difficulty']:.2f}" if item['difficulty'] is not None else '-'
+                discrimination = f"{item['discrimination']:.2f}" if item['discrimination'] is not None else '-'
+                print(f"    question {item['question_id']}: difficulty {difficulty}, discrimination {discrimination}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Re-grade stored quiz attempts and report item statistics')
+    parser.add_argument('quiz_ids', nargs='*', type=int, help='quizzes to regrade (default: all)')
+    args = parser.parse_args()
+    run(args.quiz_ids)
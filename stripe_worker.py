@@ -0,0 +1,25 @@
+import argparse
+import time
+
+from app import app, process_stripe_events
+
+
+def run(loop, interval):
+    with app.app_context():
+        while True:
+            processed = process_stripe_events()
+            if processed:
+                print(f"✓ Processed {processed} Stripe events")
+            if not loop:
+                break
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Retry stored Stripe webhook events the webhook could not apply (payments and enrollments)'
+    )
+    parser.add_argument('--loop', action='store_true', help='keep polling instead of draining once')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between polls with --loop')
+    args = parser.parse_args()
+    run(args.loop, args.interval)
@@ -0,0 +1,20 @@
+import argparse
+from datetime import timedelta
+
+from app import app, sweep_abandoned_attempts, expire_stale_payments
+
+
+def run(attempt_hours):
+    with app.app_context():
+        removed = sweep_abandoned_attempts(older_than=timedelta(hours=attempt_hours))
+        print(f"✓ Removed {removed} abandoned quiz attempts")
+        expired = expire_stale_payments()
+        print(f"✓ Expired {expired} stale pending payments")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compact rows left behind by abandoned sessions')
+    parser.add_argument('--attempt-hours', type=float, default=24,
+                        help='delete unsubmitted quiz attempts started more than this many hours ago')
+    args = parser.parse_args()
+    run(args.attempt_hours)
@@ -0,0 +1,31 @@
+"""Shared fixtures: the app is imported once, against a throwaway SQLite file."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'tests.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def login_as(client, user_id, role, name='User'):
+    with client.session_transaction() as session:
+        session['id'] = user_id
+        session['role'] = role
+        session['name'] = name
+
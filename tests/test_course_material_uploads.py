@@ -0,0 +1,96 @@
+"""Material uploads through the MATERIAL_UPLOADER hook: each file is saved as its upload finishes."""
+import io
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from app import app, db, User, Course, CourseMaterial, course_materials
+from conftest import DB_PATH, login_as
+
+SLOW_UPLOAD_TIMEOUT = 10
+
+
+def committed_materials(course_id):
+    """Rows visible to another connection, i.e. already committed by the request"""
+    with sqlite3.connect(DB_PATH) as conn:
+        return [name for (name,) in conn.execute(
+            'SELECT name FROM course_materials WHERE course_id = ? ORDER BY id', (course_id,))]
+
+
+class FakeUploader:
+    """cloudinary.uploader.upload stand-in; 'slow.pdf' holds its upload until the other files are committed"""
+
+    def __init__(self, course_id, expect_before_slow=(), fail=()):
+        self.course_id = course_id
+        self.expect_before_slow = sorted(expect_before_slow)
+        self.fail = set(fail)
+        self.seen_while_slow = None
+
+    def __call__(self, file, folder, resource_type, use_filename, unique_filename):
+        assert folder == f'course_materials/{self.course_id}'
+        if file.filename in self.fail:
+            raise RuntimeError('Cloudinary is unavailable')
+        if file.filename == 'slow.pdf':
+            deadline = time.monotonic() + SLOW_UPLOAD_TIMEOUT
+            while sorted(committed_materials(self.course_id)) != self.expect_before_slow:
+                if time.monotonic() > deadline:
+                    break
+                time.sleep(0.01)
+            self.seen_while_slow = committed_materials(self.course_id)
+        return {'secure_url': f'https://cdn.example.com/{file.filename}', 'public_id': f'id-{file.filename}'}
+
+
+@pytest.fixture
+def course(client):
+    teacher = User(name='Teacher', email='teacher@example.com', password='x', role='teacher')
+    db.session.add(teacher)
+    db.session.flush()
+    course = Course(title='Course', description='Seeded', teacher_id=teacher.id)
+    db.session.add(course)
+    db.session.commit()
+    login_as(client, teacher.id, 'teacher', 'Teacher')
+    yield course.id
+    app.config['MATERIAL_UPLOADER'] = None
+
+
+def upload(client, course_id, *filenames):
+    return client.post(f'/course/{course_id}/update-materials', data={
+        'content': 'Updated',
+        'materials': [(io.BytesIO(b'data'), filename) for filename in filenames],
+    }, content_type='multipart/form-data')
+
+
+def test_fast_uploads_are_saved_while_a_slow_one_is_running(client, course):
+    uploader = FakeUploader(course, expect_before_slow=['a.pdf', 'b.pdf'])
+    app.config['MATERIAL_UPLOADER'] = uploader
+
+    response = upload(client, course, 'slow.pdf', 'a.pdf', 'b.pdf')
+
+    assert response.status_code == 302
+    assert sorted(uploader.seen_while_slow) == ['a.pdf', 'b.pdf']
+    # Saved in completion order, but listed in the order the files were picked
+    assert committed_materials(course)[-1] == 'slow.pdf'
+    assert [m.name for m in course_materials(course)] == ['slow.pdf', 'a.pdf', 'b.pdf']
+    assert [m.path for m in course_materials(course)][0] == 'https://cdn.example.com/slow.pdf'
+
+
+def test_failed_upload_keeps_the_others(client, course):
+    app.config['MATERIAL_UPLOADER'] = FakeUploader(course, fail=['broken.pdf'])
+
+    upload(client, course, 'a.pdf', 'broken.pdf', 'b.pdf')
+
+    materials = course_materials(course)
+    assert [m.name for m in materials] == ['a.pdf', 'b.pdf']
+    assert all(m.type == 'file' and m.cloudinary_id == f'id-{m.name}' for m in materials)
+
+
+def test_new_uploads_append_after_existing_materials(client, course):
+    db.session.add(CourseMaterial(course_id=course, position=1, name='Intro', path='https://youtu.be/x', type='youtube'))
+    db.session.commit()
+    app.config['MATERIAL_UPLOADER'] = FakeUploader(course)
+
+    upload(client, course, 'a.pdf', 'b.pdf')
+
+    assert [(m.position, m.name) for m in course_materials(course)] == [(1, 'Intro'), (2, 'a.pdf'), (3, 'b.pdf')]
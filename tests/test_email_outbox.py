@@ -0,0 +1,155 @@
+"""Outbox delivery against an in-memory SMTP stand-in: retries, backoff and the 'sending' lease."""
+import smtplib
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as webapp
+from app import app, db, EmailOutbox, deliver_outbox, queue_emails, render_email
+
+
+class FakeSMTP:
+    """Stands in for a logged-in smtplib.SMTP connection; records what it was asked to send"""
+
+    def __init__(self, server):
+        self.server = server
+
+    def send_message(self, msg):
+        if self.server.down:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        if msg['To'] in self.server.refused:
+            raise smtplib.SMTPRecipientsRefused({msg['To']: (550, b'Mailbox unavailable')})
+        self.server.delivered.append(msg['To'])
+
+    def noop(self):
+        return (250, b'OK')
+
+    def quit(self):
+        pass
+
+    close = quit
+
+
+class FakeSMTPServer:
+    def __init__(self):
+        self.delivered = []
+        self.refused = set()
+        self.down = False
+        self.connections = 0
+
+    def connect(self):
+        if self.down:
+            raise ConnectionRefusedError('SMTP server is down')
+        self.connections += 1
+        return FakeSMTP(self)
+
+
+@pytest.fixture
+def smtp(client, monkeypatch):
+    server = FakeSMTPServer()
+    pool = webapp.SMTPConnectionPool()
+    monkeypatch.setattr(pool, '_connect', server.connect)
+    monkeypatch.setattr(webapp, 'smtp_pool', pool)
+    monkeypatch.setitem(app.config, 'OUTBOX_BACKGROUND_DELIVERY', False)
+    monkeypatch.setitem(app.config, 'OUTBOX_INLINE_DELIVERY', False)
+    return server
+
+
+def queue(*addresses):
+    queue_emails([render_email('announcement', address, name='Student', subject='Hello', message='Hi')
+                  for address in addresses])
+    return {email.to_email: email.id for email in EmailOutbox.query}
+
+
+def make_due(*email_ids):
+    EmailOutbox.query.filter(EmailOutbox.id.in_(email_ids)).update(
+        {EmailOutbox.next_attempt_at: datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False)
+    db.session.commit()
+
+
+def test_delivers_queued_mail_over_one_connection(smtp):
+    queue('a@example.com', 'b@example.com', 'c@example.com')
+
+    assert deliver_outbox() == 3
+
+    assert sorted(smtp.delivered) == ['a@example.com', 'b@example.com', 'c@example.com']
+    assert smtp.connections == 1
+    assert {(email.status, email.attempts) for email in EmailOutbox.query} == {('sent', 1)}
+    assert all(email.sent_at for email in EmailOutbox.query)
+
+
+def test_refused_recipient_backs_off_then_retries(smtp):
+    ids = queue('good@example.com', 'bad@example.com')
+    smtp.refused.add('bad@example.com')
+
+    before = datetime.utcnow()
+    assert deliver_outbox() == 1
+
+    bad = db.session.get(EmailOutbox, ids['bad@example.com'])
+    assert (bad.status, bad.attempts) == ('pending', 1)
+    assert 'Mailbox unavailable' in bad.last_error
+    assert bad.next_attempt_at >= before + timedelta(seconds=webapp.OUTBOX_BASE_BACKOFF_SECONDS)
+    assert db.session.get(EmailOutbox, ids['good@example.com']).status == 'sent'
+
+    # Not due yet: nothing is sent again
+    assert deliver_outbox() == 0
+
+    smtp.refused.clear()
+    make_due(bad.id)
+    assert deliver_outbox() == 1
+    db.session.refresh(bad)
+    assert (bad.status, bad.attempts) == ('sent', 2)
+    assert smtp.delivered.count('bad@example.com') == 1
+
+
+def test_backoff_doubles_until_the_message_fails(smtp):
+    ids = queue('a@example.com')
+    smtp.down = True
+    email = db.session.get(EmailOutbox, ids['a@example.com'])
+
+    delays = []
+    for attempt in range(1, webapp.OUTBOX_MAX_ATTEMPTS + 1):
+        started = datetime.utcnow()
+        assert deliver_outbox() == 0
+        db.session.refresh(email)
+        assert email.attempts == attempt
+        if attempt < webapp.OUTBOX_MAX_ATTEMPTS:
+            assert email.status == 'pending'
+            delays.append(round((email.next_attempt_at - started).total_seconds()))
+            make_due(email.id)
+
+    assert email.status == 'failed'
+    assert 'SMTP server is down' in email.last_error
+    assert delays == [webapp.OUTBOX_BASE_BACKOFF_SECONDS * 2 ** n for n in range(len(delays))]
+    make_due(email.id)
+    assert deliver_outbox() == 0
+    assert smtp.delivered == []
+
+
+def test_sending_lease_hides_rows_until_it_expires(smtp):
+    ids = queue('a@example.com')
+    claimed = webapp.claim_outbox_batch(10)
+    assert [email.id for email in claimed] == [ids['a@example.com']]
+    assert claimed[0].status == 'sending'
+
+    # Another worker must not pick up a row whose lease is still running
+    assert deliver_outbox() == 0
+    assert smtp.delivered == []
+
+    # The first worker died mid-batch: once the lease lapses the row is delivered exactly once
+    make_due(ids['a@example.com'])
+    assert deliver_outbox() == 1
+    assert smtp.delivered == ['a@example.com']
+    assert db.session.get(EmailOutbox, ids['a@example.com']).status == 'sent'
+
+
+def test_inline_delivery_sends_only_the_queued_message(smtp, monkeypatch):
+    backlog = queue('backlog1@example.com', 'backlog2@example.com')
+    monkeypatch.setitem(app.config, 'OUTBOX_INLINE_DELIVERY', True)
+
+    ids = queue('signup@example.com')
+
+    assert smtp.delivered == ['signup@example.com']
+    assert db.session.get(EmailOutbox, ids['signup@example.com']).status == 'sent'
+    assert {db.session.get(EmailOutbox, backlog[address]).status for address in backlog} == {'pending'}
+
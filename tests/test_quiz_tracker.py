@@ -0,0 +1,54 @@
+"""The quiz tracker pages attempts per quiz; teachers with hundreds of quizzes must still load it."""
+from datetime import datetime, timedelta
+
+from app import db, User, Course, Quiz, QuizAttempt, recent_attempts_by_quiz, TRACKER_UNION_CHUNK_SIZE
+from conftest import login_as
+
+QUIZ_COUNT = 600  # Past SQLite's 500-term compound SELECT limit
+
+
+def seed():
+    teacher = User(name='Teacher', email='teacher@example.com', password='x', role='teacher')
+    student = User(name='Student', email='student@example.com', password='x', role='student', email_verified=True)
+    db.session.add_all([teacher, student])
+    db.session.flush()
+    course = Course(title='Course', description='Seeded', teacher_id=teacher.id)
+    db.session.add(course)
+    db.session.flush()
+    quizzes = [Quiz(course_id=course.id, title=f'Quiz {i}', created_by=teacher.id) for i in range(QUIZ_COUNT)]
+    db.session.add_all(quizzes)
+    db.session.flush()
+
+    started = datetime(2026, 1, 1)
+    db.session.add_all(
+        QuizAttempt(quiz_id=quiz.id, student_id=student.id, score=1, max_score=1, percentage=100, passed=True,
+                    started_at=started + timedelta(minutes=n), submitted_at=started + timedelta(minutes=n, seconds=30))
+        for quiz in (quizzes[0], quizzes[-1])
+        for n in range(3)
+    )
+    db.session.commit()
+    return teacher.id, [quiz.id for quiz in quizzes]
+
+
+def test_recent_attempts_cover_every_chunk(client):
+    assert QUIZ_COUNT > 2 * TRACKER_UNION_CHUNK_SIZE
+    _, quiz_ids = seed()
+
+    attempts = recent_attempts_by_quiz(quiz_ids, limit=2)
+
+    assert set(attempts) == set(quiz_ids)
+    assert len(attempts[quiz_ids[0]]) == 3
+    assert len(attempts[quiz_ids[-1]]) == 3
+    newest = attempts[quiz_ids[-1]]
+    assert newest[0][0].submitted_at > newest[1][0].submitted_at
+    assert sum(len(page) for page in attempts.values()) == 6
+
+
+def test_tracker_renders_past_compound_select_limit(client):
+    teacher_id, _ = seed()
+    login_as(client, teacher_id, 'teacher', 'Teacher')
+
+    response = client.get(f'/teacher/{teacher_id}/quiz-tracker')
+
+    assert response.status_code == 200
+    assert b'Quiz 599' in response.data
@@ -0,0 +1,125 @@
+"""Webhook ingestion with signed events from fake_stripe_events.py: duplicates, ordering and retries."""
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as webapp
+import fake_stripe_events
+from app import db, User, Course, Enrollment, Payment, RevenueRollup, StripeEvent, process_stripe_events
+
+WEBHOOK_SECRET = 'whsec_test'
+
+
+@pytest.fixture
+def payment(client, monkeypatch):
+    monkeypatch.setattr(webapp, 'stripe_webhook_secret', WEBHOOK_SECRET)
+    teacher = User(name='Teacher', email='teacher@example.com', password='x', role='teacher')
+    student = User(name='Student', email='student@example.com', password='x', role='student', email_verified=True)
+    db.session.add_all([teacher, student])
+    db.session.flush()
+    course = Course(title='Course', description='Seeded', teacher_id=teacher.id, price=499, currency='INR')
+    db.session.add(course)
+    db.session.flush()
+    payment = Payment(student_id=student.id, course_id=course.id, amount=499, currency='INR',
+                      payment_gateway='stripe', order_id='cs_test_1', status='pending',
+                      expires_at=datetime.utcnow() + timedelta(hours=1))
+    db.session.add(payment)
+    db.session.commit()
+    return payment
+
+
+def deliver(payment, event_type, event_id=None):
+    event = fake_stripe_events.checkout_event(payment, event_type, event_id)
+    status = fake_stripe_events.send(event, WEBHOOK_SECRET)
+    db.session.expire_all()
+    return status, event
+
+
+def enrollments(payment):
+    return Enrollment.query.filter_by(student_id=payment.student_id, course_id=payment.course_id).count()
+
+
+def test_completed_event_enrolls_and_records_revenue(payment):
+    status, event = deliver(payment, 'checkout.session.completed')
+
+    assert status == 200
+    assert payment.status == 'completed'
+    assert payment.transaction_id == f'pi_fake_{payment.id}'
+    assert enrollments(payment) == 1
+    rollup = RevenueRollup.query.one()
+    assert (rollup.payment_count, rollup.revenue) == (1, 499)
+    stored = db.session.get(StripeEvent, event['id'])
+    assert (stored.status, stored.attempts) == ('processed', 1)
+
+
+def test_duplicate_delivery_is_applied_once(payment):
+    _, event = deliver(payment, 'checkout.session.completed')
+    for _ in range(2):
+        assert fake_stripe_events.send(event, WEBHOOK_SECRET) == 200
+    db.session.expire_all()
+
+    assert StripeEvent.query.count() == 1
+    assert db.session.get(StripeEvent, event['id']).attempts == 1
+    assert enrollments(payment) == 1
+    assert RevenueRollup.query.one().payment_count == 1
+
+
+def test_second_paid_event_for_the_same_session_is_a_no_op(payment):
+    deliver(payment, 'checkout.session.completed')
+    deliver(payment, 'checkout.session.completed')
+
+    assert StripeEvent.query.count() == 2
+    assert enrollments(payment) == 1
+    assert RevenueRollup.query.one().payment_count == 1
+
+
+def test_late_expired_event_does_not_undo_a_payment(payment):
+    deliver(payment, 'checkout.session.completed')
+    deliver(payment, 'checkout.session.expired')
+
+    assert payment.status == 'completed'
+    assert enrollments(payment) == 1
+
+
+def test_completed_after_expired_still_enrolls(payment):
+    deliver(payment, 'checkout.session.expired')
+    assert payment.status == 'expired'
+
+    deliver(payment, 'checkout.session.completed')
+
+    assert payment.status == 'completed'
+    assert enrollments(payment) == 1
+
+
+def test_bad_signature_stores_nothing(payment):
+    event = fake_stripe_events.checkout_event(payment, 'checkout.session.completed')
+
+    assert fake_stripe_events.send(event, 'whsec_wrong') == 400
+    assert StripeEvent.query.count() == 0
+    assert payment.status == 'pending'
+
+
+def test_failed_event_is_retried_after_its_lease(payment, monkeypatch):
+    finalize_payment = webapp.finalize_payment
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(webapp, 'finalize_payment', unavailable)
+    status, event = deliver(payment, 'checkout.session.completed')
+    assert status == 200
+    stored = db.session.get(StripeEvent, event['id'])
+    assert (stored.status, stored.attempts, stored.last_error) == ('processing', 1, 'database unavailable')
+    assert payment.status == 'pending'
+
+    monkeypatch.setattr(webapp, 'finalize_payment', finalize_payment)
+    # Still leased: the worker leaves it alone
+    assert process_stripe_events() == 0
+
+    stored.processed_at = datetime.utcnow() - timedelta(seconds=webapp.STRIPE_EVENT_LEASE_SECONDS + 1)
+    db.session.commit()
+    assert process_stripe_events() == 1
+    db.session.expire_all()
+    assert (stored.status, stored.attempts) == ('processed', 2)
+    assert payment.status == 'completed'
+    assert enrollments(payment) == 1
@@ -0,0 +1,55 @@
+"""The student dashboard must cost the same number of statements however big the catalog gets."""
+from sqlalchemy import event
+
+from app import db, User, Course, Enrollment
+from conftest import login_as
+
+MAX_DASHBOARD_QUERIES = 4
+
+
+def seed(courses, enrollments_per_student):
+    teachers = [User(name=f'Teacher {i}', email=f'teacher{i}@example.com', password='x', role='teacher')
+                for i in range(5)]
+    student = User(name='Student', email='student@example.com', password='x', role='student',
+                   email_verified=True)
+    db.session.add_all(teachers + [student])
+    db.session.flush()
+
+    catalog = [Course(title=f'Course {i}', description='Seeded', teacher_id=teachers[i % len(teachers)].id)
+               for i in range(courses)]
+    db.session.add_all(catalog)
+    db.session.flush()
+    db.session.add_all(Enrollment(student_id=student.id, course_id=course.id)
+                       for course in catalog[:enrollments_per_student])
+    db.session.commit()
+    return student.id
+
+
+def count_dashboard_queries(client, student_id):
+    login_as(client, student_id, 'student', 'Student')
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        response = client.get(f'/student/{student_id}')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_dashboard_query_count_is_constant(client):
+    small = count_dashboard_queries(client, seed(courses=5, enrollments_per_student=2))
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    large = count_dashboard_queries(client, seed(courses=200, enrollments_per_student=60))
+
+    assert small == large
+    assert large <= MAX_DASHBOARD_QUERIES